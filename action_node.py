@@ -1,98 +1,584 @@
-from router_node import get_responsible_nodes, forward_request
-from config import NODE_PORTS as ALL_KV_NODE_PORTS
+import time
+import heapq
+import base64
+import asyncio
+from itertools import groupby, islice
+
+from router_node import get_responsible_nodes, get_replica_sets, forward_request
+from config import NODE_PORTS as ALL_KV_NODE_PORTS, WRITE_QUORUM, MERKLE_FANOUT, MERKLE_DEPTH, PHI_THRESHOLD_SYNC
+from config import REPLICATION_FACTOR
+from config import SCAN_DEFAULT_LIMIT, SCAN_MAX_LIMIT, TOMBSTONE_GC_RETRY, TOMBSTONE_GC_BATCH
 from node_status_manager import node_status_manager
-from config import STATUS_OK, STATUS_ERROR, STATUS_NOT_FOUND
+from hinted_handoff import HintedHandoff, hint_prefix
+from read_cache import ReadCache
+from record import Record, is_newer
+from metrics import metrics
+from value_codec import compress, for_client
+from config import STATUS_OK, STATUS_ERROR, STATUS_NOT_FOUND, STATUS_QUORUM_NOT_MET
+
+
+def encode_cursor(last_key):
+    return base64.urlsafe_b64encode(last_key.encode()).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Cursor rỗng/None = bắt đầu từ đầu; cursor hỏng -> ValueError."""
+    if not cursor:
+        return None
+    return base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True).decode()
+
+
+def expires_at_of(cmd):
+    """Hạn tuyệt đối của một lệnh ghi: "expires_at" (đã chốt bởi node khác) hoặc now + "ttl" giây."""
+    if cmd.get("expires_at") is not None:
+        return cmd["expires_at"]
+    if cmd.get("ttl") is not None:
+        return time.time() + float(cmd["ttl"])
+    return None
+
+
+def page_args(cmd):
+    """(after, limit) của một lệnh scan/range; ValueError nếu cursor hoặc limit hỏng."""
+    limit = min(max(int(cmd.get("limit", SCAN_DEFAULT_LIMIT)), 1), SCAN_MAX_LIMIT)
+    return decode_cursor(cmd.get("cursor")), limit
+
+
+# Các action hợp lệ, dùng làm label cho metrics
+KNOWN_ACTIONS = {
+    "get_status", "metrics", "get_all_data", "scan", "range", "list_keys", "merkle_nodes", "merkle_bucket",
+    "mget", "mput", "mdelete", "replica_batch", "replica_put", "replica_delete", "put", "get", "delete",
+    "merkle_leaves", "merge_records"
+}
 
 
 class KVNodeLogic:
-    def __init__(self, kvstore, port, log_func):
+    def __init__(self, kvstore, port, log_func, write_quorum=WRITE_QUORUM):
+        if not 1 <= write_quorum <= min(REPLICATION_FACTOR, len(ALL_KV_NODE_PORTS)):
+            raise ValueError(f"WRITE_QUORUM must be between 1 and REPLICATION_FACTOR "
+                             f"({REPLICATION_FACTOR}), got {write_quorum}")
         self.kv = kvstore
         self.port = port
         self.log = log_func
+        self.write_quorum = write_quorum
+        self._background_replications = set()
+        self._inflight_gets = {}    # key -> task GET upstream đang chạy (single-flight)
+        self.read_cache = ReadCache()
+        self.workers = None         # WorkerRouter khi node chạy nhiều worker process
+        self.handoff = HintedHandoff(port, hint_prefix(kvstore.store_file), log_func, kvstore.committer)
+        self._register_metrics()
+
+    def _register_metrics(self):
+        metrics.gauge("kv_keys", "Số key trong store (kể cả tombstone)", func=lambda: len(self.kv.store))
+        metrics.gauge("kv_tombstones", "Số tombstone chưa được GC", func=lambda: self.kv.tombstones)
+        metrics.gauge("kv_hints_pending", "Số hint chờ gửi bù", func=lambda: sum(self.handoff.pending().values()))
+        metrics.counter("kv_read_cache_hits_total", "GET forward trả từ cache", func=lambda: self.read_cache.hits)
+        metrics.counter("kv_read_cache_misses_total", "GET forward phải hỏi node khác",
+                        func=lambda: self.read_cache.misses)
+
+    async def _send_replica(self, replica_port, message, records):
+        """Gửi tới một replica; nếu replica không nhận thì giữ lại hint để gửi bù."""
+        start = time.perf_counter()
+        response = await forward_request(replica_port, message)
+        if response.get("status") != STATUS_OK:
+            self.handoff.add(replica_port, records)
+            metrics.counter("kv_replication_failures_total", "Lần ghi replica không được ack (chuyển thành hint)",
+                            peer=replica_port).inc()
+        else:
+            # Từ lúc primary commit xong tới khi replica ack: độ trễ sao chép
+            metrics.histogram("kv_replication_seconds", "Thời gian tới khi replica ack",
+                              peer=replica_port).observe(time.perf_counter() - start)
+        return response
+
+    def _hint_down_replicas(self, records, nodes_of):
+        """Ghi hint cho các node chịu trách nhiệm (kể cả primary) đang DEAD."""
+        by_port = {}
+        for key, record in records.items():
+            for node_port in nodes_of(key):
+                if node_port != self.port and not node_status_manager.is_alive(node_port):
+                    by_port.setdefault(node_port, {})[key] = record.to_dict()
+        for node_port, hints in by_port.items():
+            self.handoff.add(node_port, hints)
+
+    async def replicate(self, replica_ports, message):
+        """Commit bản ghi local và gửi tới các replica song song.
+
+        Trả về số ack (tính cả node này) ngay khi đủ `write_quorum`; các replica
+        chưa trả lời vẫn tiếp tục chạy nền.
+        """
+        records = {message["key"]: {
+            "value": message.get("value"),
+            "version": message["version"],
+            "deleted": message["action"] == "replica_delete"
+        }}
+        for field in ("expires_at", "deleted_at", "codec"):
+            if message.get(field) is not None:
+                records[message["key"]][field] = message[field]
+        tasks = []
+        for replica_port in replica_ports:
+            task = asyncio.create_task(self._send_replica(replica_port, dict(message), records))
+            self._background_replications.add(task)
+            task.add_done_callback(self._background_replications.discard)
+            tasks.append(task)
+
+        await self.kv.commit()
+        acks = 1
+        if acks >= self.write_quorum:
+            return acks
+
+        for next_done in asyncio.as_completed(tasks):
+            response = await next_done
+            if response.get("status") == STATUS_OK:
+                acks += 1
+                if acks >= self.write_quorum:
+                    break
+        return acks
+
+    def _ack_fields(self, message, acks):
+        # Thiếu quorum: bản ghi vẫn nằm ở primary và replica sẽ nhận bù (hint),
+        # nhưng client phải thấy được là chưa có đảm bảo W bản
+        if acks < self.write_quorum:
+            return {
+                "status": STATUS_QUORUM_NOT_MET,
+                "message": f"{message} (write quorum not met: {acks}/{self.write_quorum})",
+                "acks": acks
+            }
+        return {"status": STATUS_OK, "message": message, "acks": acks}
+
+    async def replicate_batch(self, records, replicas_of):
+        """Bản batch của replicate(): mỗi replica nhận một `replica_batch` chứa
+        tất cả record của nó, gửi song song. Trả về số ack theo từng key."""
+        by_port = {}
+        for key, record in records.items():
+            wire_record = record.to_dict()
+            for replica_port in replicas_of(key):
+                by_port.setdefault(replica_port, {})[key] = wire_record
+
+        tasks = {}
+        for replica_port, batch in by_port.items():
+            task = asyncio.create_task(self._send_replica(replica_port, {"action": "replica_batch", "records": batch}, batch))
+            self._background_replications.add(task)
+            task.add_done_callback(self._background_replications.discard)
+            tasks[task] = batch
+
+        await self.kv.commit()
+        acks = {key: 1 for key in records}
+        if self.write_quorum <= 1 or not tasks:
+            return acks
+
+        pending = set(tasks)
+        while pending and any(n < self.write_quorum for n in acks.values()):
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result().get("status") == STATUS_OK:
+                    for key in tasks[task]:
+                        acks[key] += 1
+        return acks
+
+    def merge_remote_record(self, key, remote_data):
+        """Nhận record của node khác nếu nó mới hơn bản local (chưa commit)."""
+        remote_version = remote_data.get("version", 0)
+        remote_deleted = remote_data.get("deleted", False)
+
+        if is_newer(remote_version, remote_deleted, self.kv.get_record(key)):
+            self.kv.set_record(key, remote_data)
+            self._invalidate_read(key, remote_version)
+            self.log(f"[{self.port}] Synced key '{key}' to version {remote_version} (deleted={remote_deleted})")
+            return True
+        return False
 
     async def sync_missing_data(self):
-        all_keys = set(self.kv.store.keys())
-        self.log(f"[{self.port}] Sync started. Local keys: {list(all_keys)}")
+        """Anti-entropy: so Merkle tree của từng key range với các replica còn sống
+        và chỉ kéo về các bucket khác nhau."""
+        self.log(f"[{self.port}] Sync started. Local keys: {len(self.kv.store)}")
 
+        synced = 0
         for other_port in ALL_KV_NODE_PORTS:
-            if other_port == self.port or not node_status_manager.is_alive(other_port):
+            if other_port == self.port or not node_status_manager.is_alive(other_port, PHI_THRESHOLD_SYNC):
                 continue
-            try:
-                response = await forward_request(other_port, {"action": "list_keys"})
-                if response["status"] == STATUS_OK:
-                    all_keys.update(response["keys"])
-            except Exception:
-                pass
+            for group in sorted(get_replica_sets()):
+                if self.port not in group or other_port not in group:
+                    continue
+                try:
+                    synced += await self._sync_range(other_port, group)
+                except Exception as e:
+                    self.log(f"[{self.port}] Sync of range {group} with {other_port} failed: {e}")
 
-        for key in sorted(all_keys):
-            responsible_nodes = get_responsible_nodes(key)
-            if self.port not in responsible_nodes:
-                continue
+        if synced:
+            await self.kv.commit()
+        self.log(f"[{self.port}] Sync finished. {synced} key(s) updated")
+
+    async def _sync_range(self, other_port, group):
+        # Đi từ root xuống, mỗi tầng chỉ hỏi con của những node có hash khác nhau
+        indices = [0]
+        for depth in range(MERKLE_DEPTH + 1):
+            response = await forward_request(other_port, {
+                "action": "merkle_nodes",
+                "group": list(group),
+                "depth": depth,
+                "indices": indices
+            })
+            if response.get("status") != STATUS_OK:
+                return 0
+            remote_hashes = response["hashes"]
+            local_hashes = await self._local_merkle_hashes(group, depth, indices)
+            differing = [i for i in indices if remote_hashes.get(str(i)) != local_hashes.get(str(i))]
+            if not differing:
+                return 0
+            if depth < MERKLE_DEPTH:
+                indices = [i * MERKLE_FANOUT + child for i in differing for child in range(MERKLE_FANOUT)]
+
+        response = await forward_request(other_port, {
+            "action": "merkle_bucket",
+            "group": list(group),
+            "buckets": differing
+        })
+        if response.get("status") != STATUS_OK:
+            return 0
 
-            local_data = self.kv.store.get(key)
-            local_version = local_data.get("version", 0) if local_data else 0
-            local_deleted = local_data.get("deleted", False) if local_data else False
+        return await self._merge_records(response["data"])
 
-            for other_port in responsible_nodes:
-                if other_port == self.port or not node_status_manager.is_alive(other_port):
+    async def _local_merkle_hashes(self, group, depth, indices):
+        if self.workers is not None:
+            # Cây của cả node = gộp lá của mọi worker
+            response = await self.workers.handle({
+                "action": "merkle_nodes", "group": list(group), "depth": depth, "indices": indices
+            })
+            return response.get("hashes", {})
+        return self.kv.merkle.node_hashes(group, depth, indices)
+
+    async def _merge_records(self, records):
+        """Nhận các record của node khác; trả về số key được cập nhật."""
+        if self.workers is not None:
+            response = await self.workers.handle({"action": "merge_records", "records": records})
+            return sum(1 for result in response.get("results", {}).values() if result == "Synced")
+        return sum(1 for key, remote_data in records.items() if self.merge_remote_record(key, remote_data))
+
+    def tombstone_stats(self):
+        return {
+            "live": self.kv.tombstones,
+            "reclaimed": self.kv.tombstones_reclaimed,
+            "awaiting_gc": len(self.kv.gc_wheel)
+        }
+
+    async def collect_tombstones(self):
+        """Dọn các tombstone đã qua thời gian ân hạn.
+
+        Một tombstone chỉ được xoá hẳn khi mọi node khác trong
+        get_responsible_nodes(key) xác nhận không còn giữ bản cũ hơn của key
+        (đã có bản xoá, có bản mới hơn, hoặc không có key). Nếu có node chưa
+        xác nhận hoặc không liên lạc được, thử lại sau TOMBSTONE_GC_RETRY giây.
+        """
+        due = self.kv.due_tombstones()
+        reclaimed = 0
+        for start in range(0, len(due), TOMBSTONE_GC_BATCH):
+            batch = dict(due[start:start + TOMBSTONE_GC_BATCH])
+            by_port = {}
+            for key in batch:
+                for node_port in get_responsible_nodes(key):
+                    if node_port != self.port:
+                        by_port.setdefault(node_port, []).append(key)
+
+            ports = list(by_port)
+            responses = await asyncio.gather(*[
+                forward_request(p, {"action": "mget", "keys": by_port[p], "internal": True}) for p in ports
+            ])
+            blocked = set()
+            for port, response in zip(ports, responses):
+                if response.get("status") != STATUS_OK:
+                    blocked.update(by_port[port])
                     continue
-                try:
-                    response = await forward_request(other_port, {
-                        "action": "get",
-                        "key": key,
-                        "internal": True
-                    })
-                    if response["status"] != STATUS_OK:
+                results = response.get("results", {})
+                for key in by_port[port]:
+                    result = results.get(key, {})
+                    if result.get("status") == STATUS_NOT_FOUND:
                         continue
+                    remote = result.get("value") if result.get("status") == STATUS_OK else None
+                    tombstone = batch[key]
+                    if remote is None or remote.get("version", 0) < tombstone.version or (
+                        remote.get("version", 0) == tombstone.version and not remote.get("deleted", False)
+                    ):
+                        blocked.add(key)
 
-                    remote_data = response["value"]
-                    remote_version = remote_data.get("version", 0)
-                    remote_deleted = remote_data.get("deleted", False)
+            retry_at = time.time() + TOMBSTONE_GC_RETRY
+            for key, tombstone in batch.items():
+                if key in blocked:
+                    self.kv.retry_tombstone_gc(key, retry_at)
+                elif self.kv.purge(key, tombstone.version):
+                    reclaimed += 1
 
-                    if remote_version > local_version or (
-                        remote_version == local_version and remote_deleted and not local_deleted
-                    ):
-                        self.kv.store[key] = remote_data
-                        self.kv.save_store()
-                        self.log(f"[{self.port}] Synced key '{key}' to version {remote_version} (deleted={remote_deleted})")
-                except Exception:
-                    pass
-
-    async def act_as_temporary_primary(self, key, value=None, is_delete=False):
-        if is_delete:
-            current_version = self.kv.store.get(key, {}).get("version", 0) + 1
-            self.kv.store[key] = {
-                "value": None,
-                "version": current_version,
-                "deleted": True
-            }
-            self.kv.save_store()
+        if reclaimed:
+            await self.kv.commit()
+            self.log(f"[{self.port}] Reclaimed {reclaimed} tombstone(s); {self.kv.tombstones} remaining")
+        return reclaimed
+
+    async def act_as_temporary_primary(self, key, value=None, is_delete=False, expires_at=None):
+        metrics.counter("kv_fallback_writes_total", "Lần ghi node này làm primary tạm").inc()
+        version = self.kv.version_of(key) + 1
+        value, codec = compress(value) if not is_delete else (None, None)
+        record = self.kv.write(key, value, version, deleted=is_delete, expires_at=expires_at, codec=codec)
+        self._hint_down_replicas({key: record}, get_responsible_nodes)
+
+        replicas = [
+            replica_port for replica_port in get_responsible_nodes(key)
+            if replica_port != self.port and node_status_manager.is_alive(replica_port)
+        ]
+        acks = await self.replicate(replicas, {
+            "action": "replica_delete" if is_delete else "replica_put",
+            "key": key,
+            "value": value,
+            "version": version,
+            "expires_at": record.expires_at,
+            "deleted_at": record.deleted_at,
+            "codec": codec
+        })
+
+        return self._ack_fields(f"[Fallback] {'Deleted' if is_delete else 'Stored'} {key}", acks)
+
+    async def handle_mget(self, keys, internal=False):
+        results = {}
+        candidates = {}
+        for key in keys:
+            record = self.kv.get_record(key)
+            if record is not None:
+                if record.deleted and not internal:
+                    results[key] = {"status": STATUS_NOT_FOUND, "message": f"Key '{key}' not found (deleted)"}
+                else:
+                    results[key] = {"status": STATUS_OK, "value": record.to_dict()}
+            elif internal:
+                results[key] = {"status": STATUS_NOT_FOUND, "message": f"Key not found on peer node {self.port}"}
+            else:
+                candidates[key] = [p for p in get_responsible_nodes(key) if p != self.port]
+
+        # Mỗi vòng gửi một sub-batch song song tới replica sống kế tiếp của từng key
+        while candidates:
+            groups = {}
+            for key, ports in list(candidates.items()):
+                while ports and not node_status_manager.is_alive(ports[0]):
+                    ports.pop(0)
+                if not ports:
+                    results[key] = {"status": STATUS_NOT_FOUND, "message": f"Key '{key}' not found"}
+                    del candidates[key]
+                    continue
+                groups.setdefault(ports.pop(0), []).append(key)
+            if not groups:
+                break
+
+            responses = await asyncio.gather(*[
+                forward_request(node_port, {"action": "mget", "keys": group_keys, "internal": True})
+                for node_port, group_keys in groups.items()
+            ])
+            for group_keys, response in zip(groups.values(), responses):
+                sub_results = response.get("results", {}) if response.get("status") == STATUS_OK else {}
+                for key in group_keys:
+                    result = sub_results.get(key)
+                    if not result or result.get("status") != STATUS_OK:
+                        continue
+                    results[key] = self._not_visible(key, result["value"]) or result
+                    del candidates[key]
+        if not internal:
+            for key, result in results.items():
+                if result.get("status") == STATUS_OK:
+                    results[key] = {"status": STATUS_OK, "value": for_client(result["value"])}
+        return results
+
+    async def handle_mwrite(self, items, is_delete=False, forwarded=False, expires_at=None):
+        """MPUT / MDELETE: nhóm key theo primary, forward mỗi nhóm một lần,
+        phần thuộc về node này được ghi với một lần commit."""
+        action = "mdelete" if is_delete else "mput"
+        local, fallback, remote = {}, set(), {}
+        for key, value in items.items():
+            primary = get_responsible_nodes(key)[0]
+            if primary == self.port:
+                local[key] = value
+            elif forwarded or not node_status_manager.is_alive(primary):
+                local[key] = value
+                fallback.add(key)
+                metrics.counter("kv_fallback_writes_total", "Lần ghi node này làm primary tạm").inc()
+            else:
+                remote.setdefault(primary, {})[key] = value
+
+        async def forward_group(primary, group):
+            payload = {"action": action, "forwarded": True, "expires_at": expires_at}
+            if is_delete:
+                payload["keys"] = list(group)
+            else:
+                payload["items"] = group
+            response = await forward_request(primary, payload)
+            if response.get("status") == STATUS_OK:
+                return response.get("results", {})
+            return {key: response for key in group}
+
+        async def write_local():
+            if not local:
+                return {}
+            records, messages = {}, {}
+            for key, value in local.items():
+                existed = key in self.kv.store
+                version = self.kv.version_of(key) + 1
+                value, codec = compress(value) if not is_delete else (None, None)
+                records[key] = self.kv.write(key, value, version, deleted=is_delete, expires_at=expires_at,
+                                             codec=codec)
+                verb = "Deleted" if is_delete else ("Updated" if existed else "Stored")
+                messages[key] = f"{'[Fallback] ' if key in fallback else ''}{verb} {key}"
+
+            def replicas_of(key):
+                nodes = get_responsible_nodes(key)
+                if key not in fallback:
+                    return nodes[1:]
+                return [p for p in nodes if p != self.port and node_status_manager.is_alive(p)]
+
+            self._hint_down_replicas({k: records[k] for k in fallback}, get_responsible_nodes)
+            acks = await self.replicate_batch(records, replicas_of)
+            return {key: self._ack_fields(messages[key], acks[key]) for key in records}
+
+        results = {}
+        for part in await asyncio.gather(write_local(), *[forward_group(p, g) for p, g in remote.items()]):
+            results.update(part)
+        return results
+
+    async def handle_range(self, cmd):
+        """Range query trên toàn cluster: hỏi song song mọi node còn sống phần dữ
+        liệu local của nó trong khoảng, rồi trộn lười các danh sách đã sort.
+
+        Mỗi key lấy bản có version cao nhất giữa các replica (tombstone thắng khi
+        bằng version). Nếu một node trả về đủ `limit` record thì kết quả chỉ chắc
+        chắn đầy đủ tới key cuối của node đó; phần sau được trả qua `cursor`.
+        """
+        try:
+            after, limit = page_args(cmd)
+        except (ValueError, TypeError):
+            return {"status": STATUS_ERROR, "message": "Invalid cursor or limit"}
+        query = {
+            "action": "range",
+            "internal": True,
+            "start": cmd.get("start"),
+            "end": cmd.get("end"),
+            "prefix": cmd.get("prefix") or "",
+            "cursor": cmd.get("cursor"),
+            "limit": limit
+        }
+
+        ports = [p for p in ALL_KV_NODE_PORTS if p != self.port and node_status_manager.is_alive(p)]
+        responses = await asyncio.gather(*[forward_request(p, query) for p in ports])
+        # Cần cả tombstone: một bản xoá mới hơn phải che bản cũ trên replica khác
+        if self.workers is not None:
+            local = list((await self.workers.handle(dict(query))).get("data", {}).items())
         else:
-            existed = key in self.kv.store
-            version = self.kv.store[key]["version"] + 1 if existed else 1
-            self.kv.store[key] = {
-                "value": value,
-                "version": version,
-                "deleted": False
-            }
-            self.kv.save_store()
+            local = [(k, r.to_dict()) for k, r in islice(self.kv.iter_records(
+                query["start"], query["end"], after, query["prefix"], include_deleted=True), limit)]
+
+        pages, unreachable = [local], []
+        for port, response in zip(ports, responses):
+            if response.get("status") == STATUS_OK:
+                pages.append(list(response["data"].items()))
+            else:
+                unreachable.append(port)
 
-        for replica_port in get_responsible_nodes(key):
-            if replica_port == self.port or not node_status_manager.is_alive(replica_port):
+        # Giới hạn trên của phần kết quả chắc chắn đầy đủ
+        bound = min((page[-1][0] for page in pages if len(page) >= limit), default=None)
+        now = time.time()
+
+        data, cursor = {}, None
+        merged = heapq.merge(*pages, key=lambda item: item[0])
+        for key, copies in groupby(merged, key=lambda item: item[0]):
+            if bound is not None and key > bound:
+                cursor = encode_cursor(last_key)
+                break
+            if len(data) == limit:
+                cursor = encode_cursor(last_key)
+                break
+            last_key = key
+            record = max((r for _, r in copies), key=lambda r: (r.get("version", 0), r.get("deleted", False)))
+            if not Record.from_dict(record).is_expired(now) and not record.get("deleted", False):
+                data[key] = for_client(record)
+        else:
+            if bound is not None:
+                cursor = encode_cursor(bound)
+
+        response = {"status": STATUS_OK, "data": data, "cursor": cursor}
+        if unreachable:
+            response["unreachable"] = unreachable
+        return response
+
+    async def get_from_replicas(self, key, nodes):
+        """GET cho key không có local. Các GET đồng thời của cùng một key dùng
+        chung một request upstream; kết quả OK được cache ngắn hạn."""
+        cached = self.read_cache.get(key)
+        if cached is not None:
+            hidden = self._not_visible(key, cached["value"])
+            if hidden is None:
+                return self._for_client(cached)
+            self._invalidate_read(key)
+
+        task = self._inflight_gets.get(key)
+        if task is None:
+            task = asyncio.create_task(self._forward_get(key, nodes))
+            self._inflight_gets[key] = task
+            task.add_done_callback(lambda done: self._inflight_gets.pop(key, None)
+                                   if self._inflight_gets.get(key) is done else None)
+        # shield: một client huỷ request không được huỷ request chung
+        return self._for_client(await asyncio.shield(task))
+
+    def _invalidate_read(self, key, version=None):
+        """Một lần ghi đi qua node này: bỏ bản cache cũ và tách GET upstream đang
+        chạy (có thể đã bắt đầu trước lần ghi), để GET sau đó đọc lại từ đầu."""
+        self.read_cache.invalidate(key, version)
+        self._inflight_gets.pop(key, None)
+
+    @staticmethod
+    def _not_visible(key, data):
+        """NOT_FOUND cho record (dạng dict, lấy từ node khác hoặc cache) đã bị xoá
+        hay đã quá hạn TTL; None nếu record còn hiệu lực. Node không giữ key
+        không có lazy expiry nên phải tự xét `expires_at` ở đây."""
+        if data.get("deleted", False):
+            return {"status": STATUS_NOT_FOUND, "message": f"Key '{key}' not found (deleted)"}
+        if Record.from_dict(data).is_expired(time.time()):
+            return {"status": STATUS_NOT_FOUND, "message": f"Key '{key}' not found (expired)"}
+        return None
+
+    @staticmethod
+    def _for_client(response):
+        """Response GET (value ở dạng lưu trữ, có thể đang nén) -> bản trả cho client."""
+        response = dict(response)
+        if response.get("status") == STATUS_OK:
+            response["value"] = for_client(response["value"])
+        return response
+
+    async def _forward_get(self, key, nodes):
+        token = self.read_cache.token()
+        for node_port in nodes:
+            if node_port == self.port or not node_status_manager.is_alive(node_port):
                 continue
             try:
-                await forward_request(replica_port, {
-                    "action": "replica_delete" if is_delete else "replica_put",
-                    "key": key,
-                    "value": value if not is_delete else None,
-                    "version": current_version if is_delete else version
-                })
+                response = await forward_request(node_port, {"action": "get", "key": key, "internal": True})
+                if response.get("status") == STATUS_OK:
+                    # Tombstone / record quá hạn là câu trả lời "không có", như mget; không cache
+                    hidden = self._not_visible(key, response["value"])
+                    if hidden is not None:
+                        return hidden
+                    # Nếu một node khác có dữ liệu, trả về ngay
+                    self.read_cache.put(key, response, token)
+                    return response
             except Exception:
                 pass
-
-        return {"status": STATUS_OK, "message": f"[Fallback] {'Deleted' if is_delete else 'Stored'} {key}"}
+        # Nếu không node nào có, trả về không tìm thấy
+        return {"status": STATUS_NOT_FOUND, "message": f"Key '{key}' not found"}
 
     async def handle(self, cmd):
+        """Xử lý một lệnh, đo độ trễ và đếm kết quả theo action."""
+        action = str(cmd.get("action", "")).lower() if isinstance(cmd, dict) else ""
+        if action not in KNOWN_ACTIONS:
+            action = "unknown"      # không để client tạo ra vô số label
+        status = "exception"
+        with metrics.histogram("kv_request_seconds", "Độ trễ xử lý lệnh", action=action).time():
+            try:
+                response = await self._handle(cmd)
+                status = response.get("status", "")
+                return response
+            finally:
+                metrics.counter("kv_requests_total", "Số lệnh đã xử lý", action=action, status=status).inc()
+
+    async def _handle(self, cmd):
         action = cmd.get("action", "").lower()
         key = cmd.get("key")
         value = cmd.get("value")
@@ -102,87 +588,171 @@ class KVNodeLogic:
         if action == "get_status":
             statuses = node_status_manager.get_all_statuses()
             statuses[self.port] = "ALIVE"
-            return {"status": STATUS_OK, "data": statuses}
+            return {
+                "status": STATUS_OK,
+                "data": statuses,
+                "tombstones": self.tombstone_stats(),
+                "read_cache": {"hits": self.read_cache.hits, "misses": self.read_cache.misses}
+            }
+
+        if action == "metrics":
+            return {"status": STATUS_OK, "metrics": metrics.snapshot()}
 
         # Action nội bộ để GUI lấy toàn bộ dữ liệu của node này
         if action == "get_all_data":
-            return {"status": STATUS_OK, "data": self.kv.store}
+            return {"status": STATUS_OK, "data": {k: for_client(r) for k, r in self.kv.export().items()}}
         # --- END: Thêm code mới ---
 
+        # Duyệt dữ liệu local theo trang: trả về tối đa `limit` record và cursor
+        # của trang tiếp theo (None khi đã hết)
+        if action == "scan":
+            try:
+                after, limit = page_args(cmd)
+            except (ValueError, TypeError):
+                return {"status": STATUS_ERROR, "message": "Invalid cursor or limit"}
+            page = self.kv.scan(after, limit, cmd.get("prefix") or "", cmd.get("include_deleted", False))
+            cursor = encode_cursor(page[-1][0]) if len(page) == limit else None
+            return {
+                "status": STATUS_OK,
+                "data": {k: for_client(record.to_dict()) for k, record in page},
+                "cursor": cursor
+            }
+
+        # Range query theo thứ tự key; node nhận yêu cầu từ client sẽ scatter-gather
+        if action == "range":
+            if not cmd.get("internal"):
+                return await self.handle_range(cmd)
+            try:
+                after, limit = page_args(cmd)
+            except (ValueError, TypeError):
+                return {"status": STATUS_ERROR, "message": "Invalid cursor or limit"}
+            records = self.kv.iter_records(cmd.get("start"), cmd.get("end"), after,
+                                           cmd.get("prefix") or "", include_deleted=True)
+            return {"status": STATUS_OK, "data": {k: r.to_dict() for k, r in islice(records, limit)}}
+
         if action == "list_keys":
             return {"status": STATUS_OK, "keys": list(self.kv.store.keys())}
 
+        # Anti-entropy: hash của các node trong Merkle tree của một key range
+        if action == "merkle_nodes":
+            hashes = self.kv.merkle.node_hashes(cmd.get("group", []), cmd.get("depth", 0), cmd.get("indices", []))
+            return {"status": STATUS_OK, "hashes": hashes}
+
+        # Giữa các worker của một node: digest lá để gộp thành cây của cả node
+        if action == "merkle_leaves":
+            return {"status": STATUS_OK, "leaves": self.kv.merkle.leaves(cmd.get("group", []))}
+
+        if action == "merge_records":
+            results = {}
+            for merge_key, record in cmd.get("records", {}).items():
+                results[merge_key] = "Synced" if self.merge_remote_record(merge_key, record) else "Ignored"
+            await self.kv.commit()
+            return {"status": STATUS_OK, "results": results}
+
+        # Anti-entropy: toàn bộ record trong các bucket lá được yêu cầu
+        if action == "merkle_bucket":
+            keys = self.kv.merkle.keys_in_buckets(cmd.get("group", []), cmd.get("buckets", []))
+            return {"status": STATUS_OK, "data": self.kv.export(keys)}
+
+        # Batch: nhiều key trong một message, trả về trạng thái theo từng key
+        if action == "mget":
+            results = await self.handle_mget(cmd.get("keys", []), internal=cmd.get("internal", False))
+            return {"status": STATUS_OK, "results": results}
+
+        if action in ("mput", "mdelete"):
+            for item_key in cmd.get("items", None) or cmd.get("keys", []):
+                self._invalidate_read(item_key)
+
+        if action == "mput":
+            results = await self.handle_mwrite(cmd.get("items", {}), forwarded=cmd.get("forwarded", False),
+                                               expires_at=expires_at_of(cmd))
+            return {"status": STATUS_OK, "results": results}
+
+        if action == "mdelete":
+            items = {k: None for k in cmd.get("keys", [])}
+            results = await self.handle_mwrite(items, is_delete=True, forwarded=cmd.get("forwarded", False))
+            return {"status": STATUS_OK, "results": results}
+
+        if action == "replica_batch":
+            results = {}
+            for batch_key, record in cmd.get("records", {}).items():
+                self._invalidate_read(batch_key, record.get("version"))
+                # Cùng thứ tự với merge_remote_record: tombstone thắng khi bằng version
+                if is_newer(record.get("version", 1), record.get("deleted", False), self.kv.get_record(batch_key)):
+                    self.kv.set_record(batch_key, record)
+                    results[batch_key] = "Replicated"
+                else:
+                    results[batch_key] = "Ignored older version"
+            await self.kv.commit()
+            return {"status": STATUS_OK, "results": results}
+
         if not action or not key:
             return {"status": STATUS_ERROR, "message": "Missing action or key"}
 
         nodes = get_responsible_nodes(key)
 
+        # Mọi lần ghi đi qua node này làm mất hiệu lực bản cache cũ hơn của key
+        if action in ("put", "delete", "replica_put", "replica_delete"):
+            self._invalidate_read(key, cmd.get("version"))
+
         if action == "replica_put":
             incoming_version = cmd.get("version", 1)
-            local_data = self.kv.store.get(key)
-            if not local_data or incoming_version > local_data.get("version", 0):
-                self.kv.store[key] = {
-                    "value": value,
-                    "version": incoming_version,
-                    "deleted": False
-                }
-                self.kv.save_store()
+            if incoming_version > self.kv.version_of(key):
+                self.kv.write(key, value, incoming_version, expires_at=cmd.get("expires_at"),
+                              codec=cmd.get("codec"))
+                await self.kv.commit()
                 return {"status": STATUS_OK, "message": "Replicated"}
             return {"status": STATUS_OK, "message": "Ignored older version"}
 
         if action == "replica_delete":
             incoming_version = cmd.get("version", 1)
-            local_version = self.kv.store.get(key, {}).get("version", 0)
+            local_version = self.kv.version_of(key)
             if incoming_version > local_version:
-                self.kv.store[key] = {
-                    "value": None,
-                    "version": incoming_version,
-                    "deleted": True
-                }
-                self.kv.save_store()
+                self.kv.write(key, None, incoming_version, deleted=True, deleted_at=cmd.get("deleted_at"))
+                await self.kv.commit()
                 return {"status": STATUS_OK, "message": "Replica tombstone written"}
             return {"status": STATUS_OK, "message": "Ignored older delete version"}
 
         if action == "put":
             primary = nodes[0]
+            expires_at = expires_at_of(cmd)
             if self.port == primary:
                 existed = key in self.kv.store
-                version = self.kv.store[key]["version"] + 1 if existed else 1
-                self.kv.store[key] = {
-                    "value": value,
+                version = self.kv.version_of(key) + 1
+                # Nén một lần ở primary; replica nhận và lưu nguyên bản nén
+                stored, codec = compress(value)
+                self.kv.write(key, stored, version, expires_at=expires_at, codec=codec)
+
+                acks = await self.replicate(nodes[1:], {
+                    "action": "replica_put",
+                    "key": key,
+                    "value": stored,
                     "version": version,
-                    "deleted": False
-                }
-                self.kv.save_store()
-
-                for replica_port in nodes[1:]:
-                    try:
-                        await forward_request(replica_port, {
-                            "action": "replica_put",
-                            "key": key,
-                            "value": value,
-                            "version": version
-                        })
-                    except Exception:
-                        pass
-                return {"status": STATUS_OK, "message": f"{'Updated' if existed else 'Stored'} {key}"}
+                    "expires_at": expires_at,
+                    "codec": codec
+                })
+                return self._ack_fields(f"{'Updated' if existed else 'Stored'} {key}", acks)
 
             if cmd.get("forwarded") or not node_status_manager.is_alive(primary):
-                return await self.act_as_temporary_primary(key, value=value)
+                return await self.act_as_temporary_primary(key, value=value, expires_at=expires_at)
             else:
+                # Hạn tuyệt đối được chốt ở node nhận lệnh để forward không kéo dài TTL
                 cmd["forwarded"] = True
+                cmd["expires_at"] = expires_at
+                cmd.pop("ttl", None)
                 try:
                     return await forward_request(primary, cmd)
                 except Exception:
-                    return await self.act_as_temporary_primary(key, value=value)
+                    return await self.act_as_temporary_primary(key, value=value, expires_at=expires_at)
 
         if action == "get":
             internal = cmd.get("internal", False)
-            if key in self.kv.store:
-                record = self.kv.store[key]
-                if record.get("deleted", False) and not internal:
+            record = self.kv.get_record(key)
+            if record is not None:
+                if record.deleted and not internal:
                     return {"status": STATUS_NOT_FOUND, "message": f"Key '{key}' not found (deleted)"}
-                return {"status": STATUS_OK, "value": record}
+                data = record.to_dict()
+                return {"status": STATUS_OK, "value": data if internal else for_client(data)}
 
             # --- SỬA LỖI TẠI ĐÂY ---
             # Nếu đây là một yêu cầu nội bộ (đã được forward từ node khác)
@@ -192,42 +762,22 @@ class KVNodeLogic:
             # --- KẾT THÚC SỬA LỖI ---
 
             # Logic forward này giờ chỉ chạy cho yêu cầu ban đầu từ client
-            for node_port in nodes:
-                if node_port == self.port or not node_status_manager.is_alive(node_port):
-                    continue
-                try:
-                    cmd["internal"] = True
-                    response = await forward_request(node_port, cmd)
-                    if response.get("status") == STATUS_OK:
-                        # Nếu một node khác có dữ liệu, trả về ngay
-                        return response
-                except Exception:
-                    pass
-            # Nếu không node nào có, trả về không tìm thấy
-            return {"status": STATUS_NOT_FOUND, "message": f"Key '{key}' not found"}
+            return await self.get_from_replicas(key, nodes)
 # ...
 
         if action == "delete":
             primary = nodes[0]
             if self.port == primary:
-                current_version = self.kv.store.get(key, {}).get("version", 0) + 1
-                self.kv.store[key] = {
-                    "value": None,
+                current_version = self.kv.version_of(key) + 1
+                record = self.kv.write(key, None, current_version, deleted=True)
+
+                acks = await self.replicate(nodes[1:], {
+                    "action": "replica_delete",
+                    "key": key,
                     "version": current_version,
-                    "deleted": True
-                }
-                self.kv.save_store()
-
-                for replica_port in nodes[1:]:
-                    try:
-                        await forward_request(replica_port, {
-                            "action": "replica_delete",
-                            "key": key,
-                            "version": current_version
-                        })
-                    except Exception:
-                        pass
-                return {"status": STATUS_OK, "message": f"Deleted {key}"}
+                    "deleted_at": record.deleted_at
+                })
+                return self._ack_fields(f"Deleted {key}", acks)
 
             if not node_status_manager.is_alive(primary):
                 return await self.act_as_temporary_primary(key, is_delete=True)
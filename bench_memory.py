@@ -0,0 +1,47 @@
+"""Đo số byte mỗi key của KVStore.store: record dạng dict (cũ) so với Record (__slots__).
+
+    python bench_memory.py --keys 1000000
+
+Kết quả với 1.000.000 key, Record 6 slot (value, version, deleted, expires_at,
+deleted_at, codec): dict 336.6 -> Record 232.6 bytes/key (-104, -31%). Con số
+208.6 bytes/key ghi trong commit user-011 là lúc Record mới có 3 slot.
+"""
+import argparse
+import gc
+import tracemalloc
+
+from record import Record
+
+
+def make_dict(i):
+    return {"value": f"value-{i}", "version": 1 + i % 50, "deleted": False}
+
+
+def make_record(i):
+    return Record(f"value-{i}", 1 + i % 50, False)
+
+
+def measure(make, n):
+    gc.collect()
+    tracemalloc.start()
+    store = {}
+    for i in range(n):
+        store[f"key-{i:08d}"] = make(i)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    gc.collect()
+    return current / n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory per key of the in-memory store.")
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    before = measure(make_dict, args.keys)
+    after = measure(make_record, args.keys)
+    print(f"keys: {args.keys}")
+    print(f"dict record:   {before:7.1f} bytes/key")
+    print(f"slotted Record:{after:7.1f} bytes/key")
+    print(f"saved:         {before - after:7.1f} bytes/key ({(1 - after / before) * 100:.0f}%)")
@@ -0,0 +1,345 @@
+"""Load generator kiểu YCSB cho cluster.
+
+Mặc định tự khởi động các node trong NODE_PORTS (dữ liệu nằm trong một thư
+mục tạm, không đụng tới data/ của repo), nạp sẵn --records key rồi chạy
+workload qua giao thức của node và in throughput + p50/p95/p99/p999 theo
+từng action.
+
+    python benchmark.py --workload b --distribution zipfian --concurrency 64 --duration 20
+    python benchmark.py --read-ratio 0.5 --mode open --rate 5000 --json results.json
+    python benchmark.py --no-cluster ...          # dùng cluster đang chạy sẵn
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from config import NODE_PORTS, STATUS_OK, STATUS_NOT_FOUND
+from kv_client import KVClient
+
+# Workload chuẩn của YCSB: tỉ lệ đọc (phần còn lại là update)
+WORKLOADS = {
+    "a": 0.5,    # update heavy
+    "b": 0.95,   # read mostly
+    "c": 1.0,    # read only
+    "w": 0.0,    # write only
+}
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+class ZipfianGenerator:
+    """Sinh số trong [0, n) theo phân phối Zipf (thuật toán của Gray et al., như YCSB).
+
+    Kết quả được băm lại (scrambled) để các key nóng rải đều trên hash ring
+    thay vì dồn vào các key có số thứ tự nhỏ.
+    """
+
+    def __init__(self, n, theta=0.99, rng=random):
+        self.n = n
+        self.theta = theta
+        self.rng = rng
+        self.zetan = sum(1.0 / (i ** theta) for i in range(1, n + 1))
+        zeta2 = 1.0 + 1.0 / (2 ** theta)
+        self.alpha = 1.0 / (1.0 - theta)
+        self.eta = (1 - (2.0 / n) ** (1 - theta)) / (1 - zeta2 / self.zetan)
+
+    def next_rank(self):
+        u = self.rng.random()
+        uz = u * self.zetan
+        if uz < 1.0:
+            return 0
+        if uz < 1.0 + 0.5 ** self.theta:
+            return 1
+        return int(self.n * (self.eta * u - self.eta + 1) ** self.alpha) % self.n
+
+    def next(self):
+        # FNV-1a 64 bit trên rank
+        h = 0xcbf29ce484222325
+        for byte in self.next_rank().to_bytes(8, "little"):
+            h = ((h ^ byte) * 0x100000001b3) & 0xFFFFFFFFFFFFFFFF
+        return h % self.n
+
+
+class UniformGenerator:
+    def __init__(self, n, rng=random):
+        self.n = n
+        self.rng = rng
+
+    def next(self):
+        return self.rng.randrange(self.n)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    """Latency (giây) theo action; chỉ ghi sau khi hết warmup."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.recording = False
+
+    def record(self, action, latency, ok):
+        if not self.recording:
+            return
+        if ok:
+            self.latencies.setdefault(action, []).append(latency)
+        else:
+            self.errors[action] = self.errors.get(action, 0) + 1
+
+    def summary(self, elapsed):
+        actions = {}
+        total_ops = 0
+        for action in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(action, []))
+            total_ops += len(values)
+            actions[action] = {
+                "ops": len(values),
+                "errors": self.errors.get(action, 0),
+                "throughput": len(values) / elapsed if elapsed else 0.0,
+                "mean_ms": (sum(values) / len(values) * 1000) if values else None,
+                "max_ms": values[-1] * 1000 if values else None,
+            }
+            for p in PERCENTILES:
+                value = percentile(values, p)
+                actions[action][f"p{p:g}_ms"] = value * 1000 if value is not None else None
+        return {"elapsed_s": elapsed, "throughput": total_ops / elapsed if elapsed else 0.0, "actions": actions}
+
+
+def key_name(i):
+    return f"user{i:010d}"
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        if args.distribution == "zipfian":
+            self.keys = ZipfianGenerator(args.records, args.zipf_theta, self.rng)
+        else:
+            self.keys = UniformGenerator(args.records, self.rng)
+        self.value = "x" * args.value_size
+        self.recorder = Recorder()
+        # Với --json - thì stdout chỉ chứa document JSON
+        self.out = sys.stderr if args.json == "-" else sys.stdout
+
+    async def one_op(self, client, scheduled=None):
+        """Một thao tác; ở open loop latency tính từ thời điểm lẽ ra phải gửi
+        (tránh coordinated omission)."""
+        key = key_name(self.keys.next())
+        is_read = self.rng.random() < self.args.read_ratio
+        start = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            if is_read:
+                response = await client.call_key(key, {"action": "get", "key": key})
+                ok = response.get("status") in (STATUS_OK, STATUS_NOT_FOUND)
+            else:
+                response = await client.call_key(key, {"action": "put", "key": key, "value": self.value})
+                ok = response.get("status") == STATUS_OK
+        except Exception:
+            ok = False
+        self.recorder.record("read" if is_read else "update", time.perf_counter() - start, ok)
+
+    async def load(self, client):
+        """Nạp sẵn dữ liệu bằng mput, mỗi lô --load-batch key.
+
+        Trả về {status: số key} của các key không được ghi OK (rỗng = nạp đủ).
+        """
+        batch = self.args.load_batch
+        sem = asyncio.Semaphore(self.args.concurrency)
+        failed = {}
+
+        async def load_range(start):
+            async with sem:
+                items = {key_name(i): self.value for i in range(start, min(start + batch, self.args.records))}
+                results = await client.mput(items)
+                for key in items:
+                    status = results.get(key, {}).get("status", "MISSING")
+                    if status != STATUS_OK:
+                        failed[status] = failed.get(status, 0) + 1
+
+        await asyncio.gather(*[load_range(s) for s in range(0, self.args.records, batch)])
+        return failed
+
+    async def closed_loop(self, client, deadline):
+        async def worker():
+            while time.perf_counter() < deadline:
+                await self.one_op(client)
+        await asyncio.gather(*[worker() for _ in range(self.args.concurrency)])
+
+    async def open_loop(self, client, deadline):
+        """Gửi theo lịch Poisson với tốc độ --rate, không chờ request trước xong."""
+        pending = set()
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            now = time.perf_counter()
+            if next_at > now:
+                await asyncio.sleep(next_at - now)
+            if len(pending) >= self.args.max_outstanding:
+                # Quá tải: ghi nhận là lỗi của action "dropped" thay vì chờ
+                self.recorder.record("dropped", 0, False)
+            else:
+                task = asyncio.create_task(self.one_op(client, scheduled=next_at))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            next_at += self.rng.expovariate(self.args.rate)
+        if pending:
+            await asyncio.wait(pending)
+
+    async def run(self):
+        async with KVClient(timeout=self.args.timeout) as client:
+            if self.args.records and not self.args.skip_load:
+                started = time.perf_counter()
+                failed = await self.load(client)
+                if failed:
+                    # Key thiếu sẽ bị đo như các lần đọc NOT_FOUND bình thường -> kết quả vô nghĩa
+                    print(f"Load incomplete: {sum(failed.values())} of {self.args.records} record(s) "
+                          f"not stored {failed}", file=sys.stderr)
+                    sys.exit(1)
+                print(f"Loaded {self.args.records} record(s) in {time.perf_counter() - started:.1f}s", file=self.out)
+
+            run = self.open_loop if self.args.mode == "open" else self.closed_loop
+            if self.args.warmup > 0:
+                await run(client, time.perf_counter() + self.args.warmup)
+            self.recorder.recording = True
+            started = time.perf_counter()
+            await run(client, started + self.args.duration)
+            return self.recorder.summary(time.perf_counter() - started)
+
+
+def start_cluster(workdir, durability, workers=None):
+    """Chạy các node trong NODE_PORTS với cwd là `workdir` (có data/ riêng)."""
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    node_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "node.py")
+    processes = []
+    for port in NODE_PORTS:
+        command = [sys.executable, node_script, "--port", str(port)]
+        if durability:
+            command += ["--durability", durability]
+        if workers:
+            command += ["--workers", str(workers)]
+        processes.append(subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    return processes
+
+
+async def wait_for_cluster(timeout=15):
+    deadline = time.monotonic() + timeout
+    async with KVClient(timeout=1, retries=0) as client:
+        while time.monotonic() < deadline:
+            statuses = {}
+            for port in NODE_PORTS:
+                try:
+                    response = await client.request(port, {"action": "get_status"})
+                    statuses = response.get("data", {})
+                    break
+                except Exception:
+                    continue
+            # Chờ tới khi các node thấy nhau qua heartbeat
+            if len([s for s in statuses.values() if s == "ALIVE"]) >= len(NODE_PORTS):
+                return True
+            await asyncio.sleep(0.5)
+    return False
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def print_report(result, out=sys.stdout):
+    print(f"\nDuration: {result['elapsed_s']:.1f}s   Throughput: {result['throughput']:.0f} ops/s", file=out)
+    header = f"{'action':<8} {'ops':>9} {'err':>6} {'ops/s':>9} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'p99.9':>8} {'max':>8}"
+    print(header, file=out)
+    print("-" * len(header), file=out)
+
+    def fmt(value):
+        return f"{value:8.2f}" if value is not None else f"{'-':>8}"
+
+    for action, s in result["actions"].items():
+        print(f"{action:<8} {s['ops']:>9} {s['errors']:>6} {s['throughput']:>9.0f} {fmt(s['mean_ms'])} "
+              f"{fmt(s['p50_ms'])} {fmt(s['p95_ms'])} {fmt(s['p99_ms'])} {fmt(s['p99.9_ms'])} {fmt(s['max_ms'])}",
+              file=out)
+    print("(latency in ms)", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YCSB-style benchmark for the KV cluster.")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="b",
+                        help="a=50/50, b=95/5, c=read only, w=write only (read/update).")
+    parser.add_argument("--read-ratio", type=float, help="Override the workload's read ratio (0..1).")
+    parser.add_argument("--records", type=int, default=10000, help="Number of keys in the key space.")
+    parser.add_argument("--distribution", choices=["zipfian", "uniform"], default="zipfian")
+    parser.add_argument("--zipf-theta", type=float, default=0.99)
+    parser.add_argument("--value-size", type=int, default=100, help="Value size in bytes.")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed",
+                        help="closed: --concurrency workers back to back; open: Poisson arrivals at --rate.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=1000, help="Open loop: target ops/s.")
+    parser.add_argument("--max-outstanding", type=int, default=10000, help="Open loop: drop arrivals above this.")
+    parser.add_argument("--duration", type=float, default=10, help="Measured seconds.")
+    parser.add_argument("--warmup", type=float, default=2, help="Unmeasured seconds before the run.")
+    parser.add_argument("--timeout", type=float, default=5, help="Per request timeout.")
+    parser.add_argument("--load-batch", type=int, default=500, help="Keys per mput while loading.")
+    parser.add_argument("--skip-load", action="store_true", help="Do not preload the key space.")
+    parser.add_argument("--durability", choices=["always", "batch-ms", "none"], help="Passed to the nodes.")
+    parser.add_argument("--workers", type=int, help="Worker processes per node, passed to the nodes.")
+    parser.add_argument("--no-cluster", action="store_true", help="Use an already running cluster.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", metavar="FILE", help="Write the results as JSON ('-' for stdout).")
+    args = parser.parse_args()
+    if args.read_ratio is None:
+        args.read_ratio = WORKLOADS[args.workload]
+
+    processes = []
+    workdir = None
+    try:
+        if not args.no_cluster:
+            workdir = tempfile.mkdtemp(prefix="kvbench-")
+            processes = start_cluster(workdir, args.durability, args.workers)
+            if not asyncio.run(wait_for_cluster()):
+                print("Cluster did not come up", file=sys.stderr)
+                sys.exit(1)
+
+        result = asyncio.run(Benchmark(args).run())
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result, sys.stderr if args.json == "-" else sys.stdout)
+    if args.json:
+        output = {
+            "revision": git_revision(),
+            "timestamp": time.time(),
+            "config": {k: v for k, v in vars(args).items() if k != "json"},
+            "result": result,
+        }
+        text = json.dumps(output, indent=2)
+        if args.json == "-":
+            print(text)
+        else:
+            with open(args.json, "w") as f:
+                f.write(text)
+            print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
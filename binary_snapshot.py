@@ -0,0 +1,187 @@
+"""Snapshot nhị phân cho KVStore: index key -> offset đọc qua mmap, value nạp lười.
+
+Bố cục file (little-endian):
+
+    header   MAGIC(8) | số record (u32) | offset của index (u64) | offset của keys (u64)
+    values   các value đã mã hoá JSON (value đã nén: bytes nguyên dạng), nối liền nhau
+    index    mỗi record một entry cỡ cố định: version (i64) | flags (u8) |
+             expires_at (f64) | deleted_at (f64) | value_offset (u64) |
+             value_len (u32) | số ký tự của key (u32)
+    keys     tất cả key (utf-8) nối liền nhau, theo thứ tự của index
+
+Khi load chỉ index và keys được đọc (một lần iter_unpack, một lần decode);
+value nằm yên trong page cache cho tới khi record được đụng tới lần đầu.
+
+Chuyển các snapshot JSON cũ một lần:
+
+    python binary_snapshot.py                      # data/store_kv_node_*.json
+    python binary_snapshot.py data/store_kv_node_1.json --force
+"""
+import os
+import sys
+import glob
+import mmap
+import struct
+import argparse
+
+from protocol import json_dumps, json_loads
+from record import Record
+
+MAGIC = b"KVSNAP01"
+HEADER = struct.Struct("<8sIQQ")
+ENTRY = struct.Struct("<qBddQII")
+
+FLAG_DELETED = 1
+FLAG_EXPIRES = 2
+FLAG_DELETED_AT = 4
+FLAG_NULL_VALUE = 8
+FLAG_ZLIB = 16
+FLAG_LZMA = 32
+
+# codec của value_codec <-> flag; value nén được lưu nguyên bytes, không qua JSON
+CODEC_FLAGS = {"zlib": FLAG_ZLIB, "lzma": FLAG_LZMA}
+
+# Slot `value` của Record, để LazyRecord ghi value đã giải mã vào đúng chỗ
+_VALUE = Record.value
+
+
+class LazyRecord(Record):
+    """Record đọc từ snapshot nhị phân: value chỉ được giải mã khi đọc lần đầu.
+
+    Giữ tham chiếu tới mmap nên file cũ vẫn đọc được kể cả khi snapshot đã
+    bị thay bằng file mới; mmap được giải phóng khi record cuối cùng trỏ vào
+    nó đã được nạp hoặc bị ghi đè.
+    """
+
+    __slots__ = ("_mm", "_offset", "_length")
+
+    def __init__(self, mm, offset, length, version, deleted=False, expires_at=None, deleted_at=None,
+                 codec=None):
+        self._mm = mm
+        self._offset = offset
+        self._length = length
+        self.version = version
+        self.deleted = deleted
+        self.expires_at = expires_at
+        self.deleted_at = deleted_at
+        self.codec = codec
+
+    @property
+    def value(self):
+        if self._mm is not None:
+            raw = self._mm[self._offset:self._offset + self._length]
+            _VALUE.__set__(self, raw if self.codec is not None else json_loads(raw))
+            self._mm = None
+        return _VALUE.__get__(self)
+
+    def raw_value(self):
+        """Bytes của value trong file (JSON, hoặc bytes nén) nếu chưa được nạp, ngược lại None."""
+        mm, offset, length = self._mm, self._offset, self._length
+        return mm[offset:offset + length] if mm is not None else None
+
+
+def _encode_value(record):
+    """(flags, bytes) của value; value None không chiếm byte nào."""
+    flags = CODEC_FLAGS[record.codec] if record.codec is not None else 0
+    raw = record.raw_value() if isinstance(record, LazyRecord) else None
+    if raw is not None:
+        return flags, raw
+    value = record.value
+    if value is None:
+        return FLAG_NULL_VALUE, b""
+    if record.codec is not None:
+        return flags, bytes(value)
+    return 0, json_dumps(value).encode()
+
+
+def write_snapshot(path, store):
+    """Ghi `store` (Record hoặc dict) ra `path` theo thứ tự key, qua file tạm + os.replace."""
+    tmp_file = path + ".tmp"
+    index = bytearray()
+    keys = sorted(store)
+    with open(tmp_file, "wb", buffering=1024 * 1024) as f:
+        f.write(HEADER.pack(MAGIC, 0, 0, 0))
+        offset = HEADER.size
+        for key in keys:
+            record = store[key]
+            if isinstance(record, dict):
+                record = Record.from_dict(record)
+            flags, raw = _encode_value(record)
+            if record.deleted:
+                flags |= FLAG_DELETED
+            if record.expires_at is not None:
+                flags |= FLAG_EXPIRES
+            if record.deleted_at is not None:
+                flags |= FLAG_DELETED_AT
+            index += ENTRY.pack(record.version, flags, record.expires_at or 0.0,
+                                record.deleted_at or 0.0, offset, len(raw), len(key))
+            f.write(raw)
+            offset += len(raw)
+        f.write(index)
+        f.write("".join(keys).encode())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(keys), offset, offset + len(index)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def read_snapshot(path):
+    """{key: LazyRecord}; chỉ đọc index và keys, value ở lại trong mmap."""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, count, index_offset, keys_offset = HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or keys_offset - index_offset != count * ENTRY.size:
+        raise ValueError(f"{path} is not a valid binary snapshot")
+
+    keys = mm[keys_offset:].decode()
+    store = {}
+    pos = 0
+    for version, flags, expires_at, deleted_at, offset, length, key_len in ENTRY.iter_unpack(
+            mm[index_offset:keys_offset]):
+        key = keys[pos:pos + key_len]
+        pos += key_len
+        if flags & FLAG_NULL_VALUE:
+            record = Record(None, version, bool(flags & FLAG_DELETED))
+        else:
+            codec = next((c for c, flag in CODEC_FLAGS.items() if flags & flag), None)
+            record = LazyRecord(mm, offset, length, version, bool(flags & FLAG_DELETED), codec=codec)
+        if flags & FLAG_EXPIRES:
+            record.expires_at = expires_at
+        if flags & FLAG_DELETED_AT:
+            record.deleted_at = deleted_at
+        store[key] = record
+    return store
+
+
+def snapshot_path(store_file):
+    """Đường dẫn snapshot nhị phân tương ứng với file store JSON của node."""
+    return os.path.splitext(store_file)[0] + ".snap"
+
+
+def convert(json_file, force=False):
+    target = snapshot_path(json_file)
+    if os.path.exists(target) and not force:
+        print(f"[Convert] {target} already exists, skipping (use --force to overwrite)")
+        return False
+    with open(json_file, "r") as f:
+        content = f.read().strip()
+    store = json_loads(content) if content else {}
+    write_snapshot(target, store)
+    print(f"[Convert] {json_file} -> {target}: {len(store)} keys, "
+          f"{os.path.getsize(json_file)} -> {os.path.getsize(target)} bytes")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON store files to binary snapshots.")
+    parser.add_argument("files", nargs="*", help="file JSON (mặc định: data/store_kv_node_*.json)")
+    parser.add_argument("--force", action="store_true", help="ghi đè snapshot nhị phân đã có")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob("data/store_kv_node_*.json"))
+    if not files:
+        print("[Convert] No store files found")
+        sys.exit(1)
+    for json_file in files:
+        convert(json_file, args.force)
@@ -1,85 +1,145 @@
+import sys
 import asyncio
-import json
 import argparse
 
-from router_node import get_responsible_nodes
-from config import NODE_PORTS  
+from config import BINARY_PROTOCOL, SCAN_DEFAULT_LIMIT, NODE_PORTS
+from kv_client import KVClient, KVError
 
-async def send_command_to_node(host, port, command):
-    try:
-        reader, writer = await asyncio.open_connection(host, port)
-    except ConnectionRefusedError:
-        print(f"Connection refused at {host}:{port}")
-        return None
-    except Exception as e:
-        print(f"Could not connect to {host}:{port} - {e}")
-        return None
+# CLI chỉ là lớp mỏng bên trên kv_client.KVClient: parse tham số và in kết quả
 
+async def run_single(client, action, key, value=None, ttl=None):
     try:
-        writer.write((json.dumps(command) + "\n").encode())
-        await writer.drain()
+        if action == "GET":
+            record = await client.get_record(key)
+            if record is None:
+                print(f"Not found: Key '{key}'")
+            else:
+                print(f"Value: {record}")
+            return
+        if action == "PUT":
+            response = await client.put(key, value, ttl=ttl)
+        else:
+            response = await client.delete(key)
+    except KVError as e:
+        print(f"Error: {e}")
+        return
+    if response.get("status") == "NOT_FOUND":
+        print(f"Not found: Key '{key}'")
+    else:
+        print(f"Success: {response.get('message', 'Operation successful.')}")
 
-        data = await reader.readline()
-        if not data:
-            print("No data received or connection closed prematurely.")
-            return None
+def read_batch_input(source):
+    """Đọc các dòng từ file (hoặc stdin nếu là '-'); bỏ dòng trống và dòng bắt đầu bằng '#'."""
+    f = sys.stdin if source == "-" else open(source, "r")
+    try:
+        return [line.rstrip("\n") for line in f if line.strip() and not line.startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
 
-        try:
-            response = json.loads(data.decode().strip())
-        except json.JSONDecodeError:
-            print(f"Could not decode response: {data.decode()}")
-            return None
+async def run_batch(client, action, keys=None, items=None, ttl=None):
+    if action == "MGET":
+        results = await client.mget(keys)
+    elif action == "MPUT":
+        keys = list(items)
+        results = await client.mput(items, ttl=ttl)
+    else:
+        results = await client.mdelete(keys)
 
-        return response
+    for key in keys:
+        result = results.get(key, {})
+        status = result.get("status")
+        if status == "OK" and action == "MGET":
+            print(f"{key}: {result.get('value')}")
+        elif status == "OK":
+            print(f"{key}: {result.get('message', 'Operation successful.')}")
+        elif status == "NOT_FOUND":
+            print(f"{key}: not found")
+        else:
+            print(f"{key}: error - {result.get('message')}")
 
-    except asyncio.IncompleteReadError:
-        print("Connection closed prematurely by server.")
-    except Exception as e:
-        print(f"Communication error: {e}")
-    finally:
-        if writer and not writer.is_closing():
-            writer.close()
-            await writer.wait_closed()
-    return None
+async def run_scan(client, port, prefix=None, include_deleted=False, limit=SCAN_DEFAULT_LIMIT):
+    """In toàn bộ dữ liệu local của một node, lật từng trang "scan"."""
+    total = 0
+    try:
+        async for key, record in client.scan(port, prefix, include_deleted, limit):
+            print(f"{key}: {record}")
+            total += 1
+    except KVError as e:
+        print(f"Scan failed at node {port}: {e}")
+    print(f"{total} key(s) on node {port}")
 
-async def send_command(command):
-    nodes = get_responsible_nodes(command["key"])
+async def run_range(client, start=None, end=None, prefix=None, limit=SCAN_DEFAULT_LIMIT):
+    total = 0
+    try:
+        async for key, record in client.range(start, end, prefix, limit):
+            print(f"{key}: {record.get('value')}")
+            total += 1
+    except KVError as e:
+        print(f"Range failed: {e}")
+    print(f"{total} key(s)")
 
-    for port in nodes:
-        print(f"Trying node at port {port}...")
-        response = await send_command_to_node("127.0.0.1", port, command)
-        if response:
-            status = response.get("status")
-            if status == "OK":
-                if command.get("action") == "GET":
-                    print(f"Value: {response.get('value')}")
-                else:
-                    print(f"Success: {response.get('message', 'Operation successful.')}")
-            elif status == "NOT_FOUND":
-                print(f"Not found at node {port}: Key '{command.get('key')}'")
-            elif status == "ERROR":
-                print(f"Server error at node {port}: {response.get('message')}")
-            else:
-                print(f"Response from node {port}:", response)
-            return  
+async def run(args, **kwargs):
+    async with KVClient(binary=BINARY_PROTOCOL and not args.json) as client:
+        action = args.action
+        if action == "SCAN":
+            await run_scan(client, args.port, args.key, args.include_deleted, args.limit)
+        elif action == "RANGE":
+            await run_range(client, args.key, args.value[0] if args.value else None, args.prefix, args.limit)
+        elif action.startswith("M"):
+            await run_batch(client, action, ttl=args.ttl, **kwargs)
         else:
-            print(f" Failed to get response from node {port}. Trying next...")
-
-    print("All responsible nodes failed or unreachable.")
+            await run_single(client, action, args.key, kwargs.get("value"), args.ttl)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Client for a distributed Key-Value store.")
-    parser.add_argument("action", choices=["PUT", "GET", "DELETE"], type=str.upper, help="Action to perform.")
-    parser.add_argument("key", help="Key for the operation.")
-    parser.add_argument("value", nargs="?", help="Value (only required for PUT).")
+    parser.add_argument("action", choices=["PUT", "GET", "DELETE", "MPUT", "MGET", "MDELETE", "SCAN", "RANGE"], type=str.upper, help="Action to perform.")
+    parser.add_argument("key", nargs="?", help="Key for the operation (MGET/MDELETE: first of several keys; SCAN: key prefix; RANGE: start key).")
+    parser.add_argument("value", nargs="*", help="Value (only required for PUT); more keys for MGET/MDELETE; RANGE: end key (exclusive).")
+    parser.add_argument("-f", "--file", help="Batch input: one key (MGET/MDELETE) or 'key value' (MPUT) per line; '-' for stdin.")
+    parser.add_argument("--json", action="store_true", help="Use newline-delimited JSON instead of binary frames.")
+    parser.add_argument("--port", type=int, default=NODE_PORTS[0], help="SCAN: node to read from.")
+    parser.add_argument("--include-deleted", action="store_true", help="SCAN: also list tombstones.")
+    parser.add_argument("--ttl", type=float, help="PUT/MPUT: expire the key(s) after this many seconds.")
+    parser.add_argument("--prefix", help="RANGE: only keys starting with this prefix.")
+    parser.add_argument("--limit", type=int, default=SCAN_DEFAULT_LIMIT, help="SCAN/RANGE: page size.")
     args = parser.parse_args()
 
-    command = {"action": args.action, "key": args.key}
-    if args.action == "PUT":
-        if args.value is None:
-            parser.error("PUT action requires a value argument.")
-        command["value"] = args.value
-    elif args.value is not None:
-        print(f"⚠️ Value argument '{args.value}' is ignored for {args.action} action.")
+    if args.action in ("SCAN", "RANGE"):
+        asyncio.run(run(args))
+        sys.exit(0)
+
+    if args.action.startswith("M"):
+        lines = read_batch_input(args.file) if args.file else []
+        if args.action == "MPUT":
+            items = {}
+            for line in lines:
+                parts = line.split(None, 1)
+                if len(parts) != 2:
+                    parser.error(f"MPUT line must be 'key value': {line!r}")
+                items[parts[0]] = parts[1]
+            if args.key is not None:
+                if len(args.value) != 1:
+                    parser.error("MPUT on the command line takes exactly one key and one value; use --file for more.")
+                items[args.key] = args.value[0]
+            if not items:
+                parser.error("MPUT requires --file or a key and value.")
+            asyncio.run(run(args, items=items))
+        else:
+            keys = lines + ([args.key] if args.key is not None else []) + args.value
+            if not keys:
+                parser.error(f"{args.action} requires keys or --file.")
+            asyncio.run(run(args, keys=keys))
+        sys.exit(0)
+
+    if args.key is None:
+        parser.error(f"{args.action} action requires a key.")
+    value = " ".join(args.value) if args.value else None
+
+    if args.action == "PUT" and value is None:
+        parser.error("PUT action requires a value argument.")
+    if args.action != "PUT" and value is not None:
+        print(f"⚠️ Value argument '{value}' is ignored for {args.action} action.")
+        value = None
 
-    asyncio.run(send_command(command))
+    asyncio.run(run(args, value=value))
@@ -2,15 +2,87 @@
 
 NODE_HOST = "127.0.0.1"
 NODE_PORTS = [8888, 8889, 8890]
-REPLICATION_FACTOR = 2  
+REPLICATION_FACTOR = 2   # số node giữ mỗi key (primary + replica)
+VIRTUAL_NODES = 128    # số token trên hash ring cho mỗi node (weight = 1)
+NODE_WEIGHTS = {}      # port -> weight, ví dụ {8890: 2} để node 8890 giữ gấp đôi số key
+RING_CACHE_SIZE = 10000  # số key -> preference list được cache
+WRITE_QUORUM = 1       # số bản ghi (tính cả primary) cần ack trước khi trả lời client; tối đa REPLICATION_FACTOR
 
      
 HEARTBEAT_INTERVAL = 2             
 HEARTBEAT_TIMEOUT = 5  
 NODE_TIMEOUT = 15 
 
+# Phi-accrual failure detector: node bị coi là DEAD khi phi >= ngưỡng của nơi gọi
+PHI_WINDOW_SIZE = 100          # số khoảng cách heartbeat gần nhất được giữ cho mỗi node
+PHI_MIN_STD = 0.5              # giây, độ lệch chuẩn tối thiểu để tránh quá nhạy khi mạng rất đều
+PHI_ACCEPTABLE_PAUSE = 1.0     # giây trễ (GC, loop bận) được bỏ qua trước khi phi tăng
+PHI_THRESHOLD_ROUTING = 8      # chọn primary / fallback: cao để tránh ghi fallback vì DEAD giả
+PHI_THRESHOLD_SYNC = 3         # sync / hinted handoff: chỉ bắt đầu với node vừa nghe thấy
+
+# Write-ahead log của KVStore
+WAL_SEGMENT_MAX_BYTES = 4 * 1024 * 1024   # đóng segment khi vượt quá kích thước này
+WAL_COMPACT_MIN_SEGMENTS = 2              # số segment đã đóng tối thiểu để chạy compaction
+DURABILITY_MODE = "batch-ms"              # "always" | "batch-ms" | "none"
+GROUP_COMMIT_WINDOW_MS = 2                # cửa sổ gom ghi cho chế độ batch-ms
+SNAPSHOT_FORMAT = "binary"                # "binary" (.snap, mmap, value nạp lười) | "json"
+
+# Nén value lớn: primary nén một lần, replica / đĩa giữ bản nén, chỉ giải nén khi trả cho client
+VALUE_CODEC = None                 # None (tắt) | "zlib" | "lzma"
+VALUE_COMPRESS_THRESHOLD = 1024    # byte; chuỗi ngắn hơn được lưu nguyên
+
+# Hinted handoff: các lần ghi replica bị lỡ được giữ lại và gửi bù theo lô
+HINT_BATCH_SIZE = 100
+HINT_RETRY_INTERVAL = 2    # giây giữa các lần thử lại khi node đích vẫn chưa nhận
+
+# TTL: hạn của key được theo dõi bằng hierarchical timer wheel
+TTL_WHEEL_TICK = 0.1     # giây mỗi ô của tầng thấp nhất (độ phân giải của expirer)
+TTL_WHEEL_SLOTS = 64     # số ô mỗi tầng
+TTL_WHEEL_LEVELS = 4     # 4 tầng x 64 ô x 0.1s ~ 19 ngày, xa hơn thì vào overflow
+
+# Dọn tombstone: chỉ xoá hẳn sau thời gian ân hạn và khi mọi replica đã có bản xoá
+TOMBSTONE_GRACE_PERIOD = 3600   # giây giữ tombstone kể từ deleted_at
+TOMBSTONE_GC_INTERVAL = 30      # giây giữa các lần chạy GC
+TOMBSTONE_GC_RETRY = 300        # replica chưa xác nhận -> thử lại sau chừng này giây
+TOMBSTONE_GC_BATCH = 500        # số key hỏi replica trong một message
+
+# GET forward từ node không giữ key: cache ngắn hạn (0 = tắt) và gộp request trùng.
+# Bật cache thì GET qua node không giữ key có thể trả bản cũ tối đa READ_CACHE_TTL
+# giây sau khi primary đã ack bản mới (node đó không nhận message replica của key).
+READ_CACHE_TTL = 0         # giây; vd 0.5 để bật
+READ_CACHE_SIZE = 10000    # số key tối đa trong cache
+
+# Scan phân trang (thay cho get_all_data)
+SCAN_DEFAULT_LIMIT = 100
+SCAN_MAX_LIMIT = 1000
+
+# Anti-entropy: Merkle tree trên mỗi key range, MERKLE_FANOUT ** MERKLE_DEPTH bucket lá
+MERKLE_FANOUT = 16
+MERKLE_DEPTH = 3
+
+# Giao thức: frame nhị phân có độ dài (True) hay JSON theo dòng (False) cho kết nối đi ra
+BINARY_PROTOCOL = True
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+# Metrics: histogram HDR với METRICS_SIGNIFICANT_BITS bit (~3% sai số); HTTP /metrics ở port + offset (0 = tắt)
+METRICS_SIGNIFICANT_BITS = 6
+METRICS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_PORT_OFFSET = 2000
+
+# Pipelining: số request có "id" được xử lý đồng thời trên một kết nối
+MAX_INFLIGHT_PER_CONNECTION = 64
+
+# Worker process: số process của một node cùng nghe trên một port (SO_REUSEPORT, chỉ Linux/BSD)
+NODE_WORKERS = 1
+WORKER_SOCKET_DIR = "data"     # Unix socket giữa các worker: data/node_<port>.w<i>.sock
+
+# Pool kết nối giữa các node
+POOL_MAX_SIZE = 4          # số kết nối tối đa tới mỗi peer
+POOL_IDLE_TIMEOUT = 30     # giây; kết nối rảnh lâu hơn sẽ bị đóng
+
 STATUS_OK = "OK"
 STATUS_ERROR = "ERROR"
 STATUS_NOT_FOUND = "NOT_FOUND"
+STATUS_QUORUM_NOT_MET = "QUORUM_NOT_MET"   # đã ghi ở primary nhưng chưa đủ WRITE_QUORUM ack
 
 
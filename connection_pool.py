@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import time
+
+from config import NODE_HOST, POOL_MAX_SIZE, POOL_IDLE_TIMEOUT, MAX_INFLIGHT_PER_CONNECTION, BINARY_PROTOCOL
+from protocol import open_stream
+
+# Lệnh gửi lại được sau khi kết nối đứt giữa chừng: chỉ đọc, hoặc ghi có version
+# (replica bỏ qua bản không mới hơn). put/delete/mput/mdelete... không có ở đây:
+# lần gửi đầu có thể đã được áp dụng, gửi lại sẽ tăng version / kéo dài TTL lần nữa.
+RETRY_SAFE_ACTIONS = {
+    "get", "mget", "scan", "range", "list_keys", "get_status", "metrics", "metrics_text",
+    "get_all_data", "merkle_nodes", "merkle_bucket", "merkle_leaves", "heartbeat_seen",
+    "replica_put", "replica_delete", "replica_batch", "merge_records"
+}
+
+
+class PipelinedConnection:
+    """Một kết nối có thể chở nhiều request cùng lúc.
+
+    Mỗi request được gắn "id"; một task đọc response và trả về cho đúng
+    request theo id, nên response có thể về không theo thứ tự và một request
+    chậm không chặn các request khác trên cùng kết nối.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.last_used = time.monotonic()
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._write_lock = asyncio.Lock()
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    @property
+    def inflight(self):
+        return len(self._pending)
+
+    def is_healthy(self):
+        # Peer đóng kết nối (restart, crash) thì reader sẽ nhận EOF
+        return not self.closed and not self.stream.is_closing() and not self.stream.at_eof()
+
+    async def _read_loop(self):
+        error = ConnectionError("Connection closed by peer")
+        try:
+            while True:
+                message = await self.stream.read_message()
+                if message is None:
+                    break
+                future = self._pending.pop(message.pop("id", None), None)
+                # Response của request đã timeout thì bỏ qua
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = ConnectionError(f"Connection lost: {e}")
+        finally:
+            self.closed = True
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    async def request(self, data, timeout=5):
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.last_used = time.monotonic()
+        try:
+            message = dict(data)
+            message["id"] = request_id
+            async with self._write_lock:
+                await self.stream.send(message)
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            self._pending.pop(request_id, None)
+            self.last_used = time.monotonic()
+
+    def close(self):
+        self.closed = True
+        self._reader_task.cancel()
+        try:
+            self.stream.close()
+        except Exception:
+            pass
+
+
+async def open_pipelined(host, port, timeout=5, binary=BINARY_PROTOCOL, path=None):
+    stream = await asyncio.wait_for(open_stream(host, port, binary=binary, path=path), timeout=timeout)
+    return PipelinedConnection(stream)
+
+
+class ConnectionPool:
+    """Pool các kết nối pipelined sống lâu tới một peer.
+
+    Request được gửi trên kết nối đang ít request nhất; chỉ mở thêm kết nối
+    (tối đa `max_size`) khi mọi kết nối đã có `max_inflight` request.
+    Kết nối chết hoặc rảnh quá `idle_timeout` bị loại ở mỗi lần checkout.
+    `path` thay (host, port) bằng một Unix socket (giữa các worker của một node).
+    """
+
+    def __init__(self, host, port, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 max_inflight=MAX_INFLIGHT_PER_CONNECTION, binary=BINARY_PROTOCOL, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.binary = binary
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_inflight = max_inflight
+        self._conns = []
+        self._open_lock = asyncio.Lock()
+
+    def _evict(self):
+        now = time.monotonic()
+        alive = []
+        for conn in self._conns:
+            idle_too_long = conn.inflight == 0 and now - conn.last_used > self.idle_timeout
+            if conn.is_healthy() and not idle_too_long:
+                alive.append(conn)
+            else:
+                conn.close()
+        self._conns = alive
+
+    async def _open(self, timeout):
+        conn = await open_pipelined(self.host, self.port, timeout, binary=self.binary, path=self.path)
+        self._conns.append(conn)
+        return conn
+
+    def _pick(self):
+        self._evict()
+        conn = min(self._conns, key=lambda c: c.inflight, default=None)
+        if conn is not None and (conn.inflight < self.max_inflight or len(self._conns) >= self.max_size):
+            return conn
+        return None
+
+    async def request(self, data, timeout=5):
+        conn = self._pick()
+        if conn is None:
+            async with self._open_lock:
+                conn = self._pick()
+                if conn is None:
+                    conn = await self._open(timeout)
+            return await conn.request(data, timeout=timeout)
+
+        try:
+            return await conn.request(data, timeout=timeout)
+        except (ConnectionError, OSError):
+            # Kết nối cũ đã chết phía peer -> kết nối lại một lần, nếu lệnh gửi lại được
+            conn.close()
+            self._evict()
+            if data.get("action") not in RETRY_SAFE_ACTIONS:
+                raise
+            return await (await self._open(timeout)).request(data, timeout=timeout)
+
+    def close(self):
+        for conn in self._conns:
+            conn.close()
+        self._conns = []
+
+
+_pools = {}
+
+
+def get_pool(port, host=NODE_HOST):
+    pool = _pools.get((host, port))
+    if pool is None:
+        pool = _pools[(host, port)] = ConnectionPool(host, port)
+    return pool
+
+
+def close_all_pools():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
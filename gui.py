@@ -22,6 +22,8 @@ COLORS = {
     'SYSTEM': 'red'
 }
 UPDATE_INTERVAL_MS = 2000 # Cập nhật hiển thị mỗi 2 giây
+SCAN_PAGE_SIZE = 200      # số record mỗi lần gọi "scan"
+MAX_DISPLAY_KEYS = 1000   # chỉ hiển thị tối đa chừng này key cho mỗi node
 
 class KeyValueGUI:
     def __init__(self, root):
@@ -165,16 +167,49 @@ class KeyValueGUI:
             self.update_text_widget(widget, "-- NODE IS DEAD --")
             return
 
-        cmd = {"action": "get_all_data"}
         try:
-            response = await self._send_internal_command_async(port, cmd)
+            data, response = await self._scan_node_async(port)
             if response and response.get("status") == "OK":
-                data_text = json.dumps(response.get("data", {}), indent=2)
+                data_text = json.dumps(data, indent=2)
+                if response.get("cursor"):
+                    data_text += f"\n-- showing first {len(data)} keys --"
                 self.update_text_widget(widget, data_text)
             else:
                 self.update_text_widget(widget, f"-- FAILED TO FETCH DATA --\n{response}")
         except Exception as e:
             self.update_text_widget(widget, f"-- NODE UNREACHABLE --\n{type(e).__name__}")
+
+    async def _scan_node_async(self, port):
+        """Đọc dữ liệu của node theo từng trang "scan" trên cùng một kết nối.
+
+        Trả về (data, response cuối cùng); dừng khi hết cursor hoặc đủ MAX_DISPLAY_KEYS.
+        """
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection("127.0.0.1", port), timeout=1.0
+        )
+        data, response, cursor = {}, None, None
+        try:
+            while len(data) < MAX_DISPLAY_KEYS:
+                cmd = {
+                    "action": "scan",
+                    "cursor": cursor,
+                    "limit": min(SCAN_PAGE_SIZE, MAX_DISPLAY_KEYS - len(data)),
+                    "include_deleted": True
+                }
+                writer.write((json.dumps(cmd) + "\n").encode())
+                await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), timeout=1.0)
+                response = json.loads(line.decode().strip()) if line else None
+                if not response or response.get("status") != "OK":
+                    break
+                data.update(response.get("data", {}))
+                cursor = response.get("cursor")
+                if not cursor:
+                    break
+        finally:
+            writer.close()
+            await writer.wait_closed()
+        return data, response
     
     async def _send_internal_command_async(self, port, command):
         """Hàm helper để gửi các lệnh nội bộ lấy thông tin."""
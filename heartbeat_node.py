@@ -1,56 +1,91 @@
 import asyncio
-import json
 import time
-from config import NODE_PORTS as ALL_NODE_PORTS, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, NODE_HOST
+from config import NODE_PORTS as ALL_NODE_PORTS, HEARTBEAT_INTERVAL, NODE_HOST
 from node_status_manager import node_status_manager  # dùng singleton
+from protocol import open_stream, accept_stream
+from metrics import metrics
 
 
 class HeartbeatManager:
-    def __init__(self, port, log_callback=None):
+    def __init__(self, port, log_callback=None, on_heartbeat=None):
         self.port = port
+        self.on_heartbeat = on_heartbeat  # gọi với port của node gửi, sau mỗi heartbeat nhận được
         self.ready = False
         self.log_callback = log_callback or print
         self._running = True
         self.last_failed_log = {}  # để tránh log trùng lặp
+        for peer in ALL_NODE_PORTS:
+            if peer != port:
+                metrics.gauge("kv_peer_phi", "Phi của failure detector (-1: chưa từng nghe thấy)",
+                              func=lambda p=peer: self._phi(p), peer=peer)
+
+    @staticmethod
+    def _phi(peer):
+        phi = node_status_manager.phi(peer)
+        return round(phi, 3) if phi != float("inf") else -1
 
     def log(self, message):
         self.log_callback(f" {message}")
 
     async def send_heartbeat(self):
+        # Mỗi peer có một kênh riêng chạy song song: peer không kết nối được
+        # chỉ làm chậm kênh của chính nó, không chặn heartbeat tới các node khác.
+        await asyncio.gather(*[
+            self._heartbeat_channel(target_port)
+            for target_port in ALL_NODE_PORTS if target_port != self.port
+        ])
+
+    async def _heartbeat_channel(self, target_port):
+        """Giữ một kết nối TCP sống lâu tới peer và gửi heartbeat trên đó mỗi
+        HEARTBEAT_INTERVAL; chỉ kết nối lại khi kết nối bị đứt."""
+        stream = None
         while self._running:
-            for target_port in ALL_NODE_PORTS:
-                if target_port == self.port:
-                    continue
-                try:
-                    reader, writer = await asyncio.open_connection(NODE_HOST, target_port + 1000)
-                    message = {"type": "heartbeat", "from": self.port}
-                    writer.write((json.dumps(message) + "\n").encode())
-                    await writer.drain()
-                    writer.close()
-                    await writer.wait_closed()
-                except Exception as e:
-                    if self.ready:
-                        now = time.time()
-                        last_log = self.last_failed_log.get(target_port, 0)
-                        if now - last_log > 5 and node_status_manager.is_alive(target_port, HEARTBEAT_TIMEOUT):
-                            self.log(f"Could not send heartbeat to {target_port}: {e}")
-                            self.last_failed_log[target_port] = now
+            try:
+                if stream is None or stream.is_closing():
+                    stream = await asyncio.wait_for(
+                        open_stream(NODE_HOST, target_port + 1000), timeout=HEARTBEAT_INTERVAL)
+                await asyncio.wait_for(
+                    stream.send({"type": "heartbeat", "from": self.port}), timeout=HEARTBEAT_INTERVAL)
+                metrics.counter("kv_heartbeats_sent_total", "Heartbeat đã gửi", peer=target_port).inc()
+            except Exception as e:
+                metrics.counter("kv_heartbeat_failures_total", "Heartbeat gửi không được", peer=target_port).inc()
+                if stream is not None:
+                    stream.close()
+                    stream = None
+                if self.ready:
+                    now = time.time()
+                    last_log = self.last_failed_log.get(target_port, 0)
+                    if now - last_log > 5 and node_status_manager.is_alive(target_port):
+                        self.log(f"Could not send heartbeat to {target_port}: {e or type(e).__name__}")
+                        self.last_failed_log[target_port] = now
             await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if stream is not None:
+            stream.close()
 
     async def receive_heartbeat(self, reader, writer):
+        # Một kết nối chở heartbeat liên tục cho tới khi peer đóng nó
         try:
-            data = await reader.readline()
-            if not data:
-                return
-            message = json.loads(data.decode())
-            if message.get("type") == "heartbeat":
-                sender_port = message.get("from")
-                node_status_manager.update(sender_port)  # ✅ Cập nhật tại đây
+            stream = await accept_stream(reader, writer)
+            while stream is not None:
+                message = await stream.read_message()
+                if message is None:
+                    break
+                if message.get("type") == "heartbeat":
+                    sender_port = message.get("from")
+                    node_status_manager.update(sender_port)  # ✅ Cập nhật tại đây
+                    metrics.counter("kv_heartbeats_received_total", "Heartbeat đã nhận", peer=sender_port).inc()
+                    if self.on_heartbeat is not None:
+                        self.on_heartbeat(sender_port)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # peer crash / restart, kênh mới sẽ được mở lại
         except Exception as e:
             self.log(f"Error processing heartbeat: {e}")
         finally:
             writer.close()
-            await writer.wait_closed()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
 
     async def start_server(self):
         server = await asyncio.start_server(self.receive_heartbeat, NODE_HOST, self.port + 1000)
@@ -65,7 +100,7 @@ class HeartbeatManager:
         prev_status = {}  # Lưu trạng thái trước đó
 
         while self._running:
-            status_dict = node_status_manager.get_all_statuses(HEARTBEAT_TIMEOUT)
+            status_dict = node_status_manager.get_all_statuses()
             for node_id, status in status_dict.items():
                 if node_id == self.port:
                     continue
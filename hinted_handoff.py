@@ -0,0 +1,202 @@
+import os
+import glob
+import asyncio
+from collections import OrderedDict
+
+from router_node import forward_request
+from node_status_manager import node_status_manager
+from protocol import json_dumps, json_loads
+from config import STATUS_OK, HINT_BATCH_SIZE, HINT_RETRY_INTERVAL, PHI_THRESHOLD_SYNC
+
+
+def hint_prefix(store_file):
+    """Tiền tố file hint của một store: data/store_kv_node_1.json -> data/store_kv_node_1.hints."""
+    return os.path.splitext(store_file)[0] + ".hints."
+
+
+def hint_files(path_prefix):
+    """{port đích: đường dẫn} của các hàng đợi hint đang có trên đĩa."""
+    files = {}
+    for path in glob.glob(path_prefix + "*"):
+        suffix = path[len(path_prefix):]
+        if suffix.isdigit():
+            files[int(suffix)] = path
+    return files
+
+
+def write_hints(path, hints):
+    """Ghi trọn một hàng đợi {key: record} qua file tạm + os.replace."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for key, record in hints.items():
+            f.write(json_dumps({"key": key, "record": record}) + "\n")
+    os.replace(tmp_path, path)
+
+
+def _run_inline(func, *args):
+    return func(*args)
+
+
+class HintQueue:
+    """Các lần ghi mà một node đích đã bỏ lỡ, lưu bền vững trong một file append-only.
+
+    Mỗi key chỉ giữ record có version cao nhất; file được viết lại gọn khi
+    hàng đợi đã giao bớt. Hàng đợi trong RAM đổi ngay trên event loop, còn
+    mọi thao tác file đi qua `run` (GroupCommitter.run của store: persistence
+    worker, theo thứ tự với WAL) và fsync nếu `fsync`.
+    """
+
+    def __init__(self, path, run=_run_inline, fsync=False):
+        self.path = path
+        self.hints = OrderedDict()
+        self._run = run
+        self.fsync = fsync
+        self._file = None      # chỉ persistence worker mở / ghi
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json_loads(line)
+                except ValueError:
+                    continue  # dòng ghi dở khi crash
+                self._remember(entry["key"], entry["record"])
+
+    def _remember(self, key, record):
+        current = self.hints.get(key)
+        if current is None or record.get("version", 0) >= current.get("version", 0):
+            self.hints[key] = record
+            self.hints.move_to_end(key)
+            return True
+        return False
+
+    def add(self, records):
+        """records: {key: record dạng dict}; một lần append (+ fsync) cho cả lô."""
+        lines = [json_dumps({"key": key, "record": record}) + "\n"
+                 for key, record in records.items() if self._remember(key, record)]
+        if lines:
+            return self._run(self._append, lines)
+        return None
+
+    def _append(self, lines):
+        if self._file is None:
+            self._file = open(self.path, "a")
+        self._file.write("".join(lines))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def peek(self, limit):
+        return list(self.hints.items())[:limit]
+
+    def ack(self, delivered):
+        for key, record in delivered:
+            # Chỉ xoá nếu trong lúc gửi không có hint mới hơn cho key đó
+            if self.hints.get(key) is record:
+                del self.hints[key]
+
+    def compact(self):
+        """Viết lại file chỉ với các hint chưa giao."""
+        return self._run(self._rewrite, dict(self.hints))
+
+    def _rewrite(self, hints):
+        self._close_file()
+        write_hints(self.path, hints)
+
+    def __len__(self):
+        return len(self.hints)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        return self._run(self._close_file)
+
+
+class HintedHandoff:
+    """Giữ hint cho từng node đích và gửi chúng theo lô `replica_batch` ngay khi
+    node_status_manager thấy node đó ALIVE trở lại.
+
+    Có `committer` (GroupCommitter của store) thì file hint được ghi trên
+    persistence worker với cùng chế độ durability như WAL.
+    """
+
+    def __init__(self, port, path_prefix, log_func, committer=None):
+        self.port = port
+        self.path_prefix = path_prefix
+        self.log = log_func
+        self._run = committer.run if committer is not None else _run_inline
+        self._fsync = committer is not None and committer.mode != "none"
+        self.queues = {target_port: self._new_queue(path) for target_port, path in hint_files(path_prefix).items()}
+        self._wakeup = None
+        node_status_manager.add_listener(self._on_node_alive)
+
+    def _queue(self, target_port):
+        queue = self.queues.get(target_port)
+        if queue is None:
+            queue = self.queues[target_port] = self._new_queue(f"{self.path_prefix}{target_port}")
+        return queue
+
+    def _new_queue(self, path):
+        return HintQueue(path, self._run, self._fsync)
+
+    def add(self, target_port, records):
+        """records: {key: record dạng dict} mà `target_port` chưa nhận được.
+
+        Việc ghi file chạy trên persistence worker, trước mọi lô WAL được gửi
+        sau đó: commit của lần ghi local vừa sinh ra hint chỉ xong khi hint đã
+        xuống đĩa.
+        """
+        future = self._queue(target_port).add(records)
+        if future is not None:
+            future.add_done_callback(lambda f: f.exception() and self.log(
+                f"[{self.port}] Failed to persist hints for {target_port}: {f.exception()}"))
+
+    def pending(self):
+        return {port: len(queue) for port, queue in self.queues.items() if len(queue)}
+
+    def _on_node_alive(self, node_id):
+        if node_id in self.queues and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def deliver(self, target_port):
+        queue = self.queues.get(target_port)
+        delivered = 0
+        while queue is not None and len(queue) and node_status_manager.is_alive(target_port, PHI_THRESHOLD_SYNC):
+            batch = queue.peek(HINT_BATCH_SIZE)
+            response = await forward_request(target_port, {
+                "action": "replica_batch",
+                "records": dict(batch)
+            })
+            if response.get("status") != STATUS_OK:
+                break
+            queue.ack(batch)
+            delivered += len(batch)
+        if delivered:
+            queue.compact()
+            self.log(f"[{self.port}] Handed off {delivered} hinted write(s) to {target_port}")
+        return delivered
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            for target_port in list(self.queues):
+                if len(self.queues[target_port]) and node_status_manager.is_alive(target_port, PHI_THRESHOLD_SYNC):
+                    try:
+                        await self.deliver(target_port)
+                    except Exception as e:
+                        self.log(f"[{self.port}] Hinted handoff to {target_port} failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=HINT_RETRY_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def close(self):
+        for queue in self.queues.values():
+            queue.close()
@@ -0,0 +1,84 @@
+from bisect import bisect_left, bisect_right, insort
+
+# Số key tối đa trong một khối trước khi tách đôi
+CHUNK_SIZE = 1000
+
+
+class SortedKeys:
+    """Tập key có thứ tự, chia thành các khối đã sort (kiểu sortedcontainers).
+
+    Thêm/xoá chỉ dịch chuyển trong một khối nhỏ nên chi phí gần như không
+    đổi khi store lớn lên; duyệt theo khoảng bắt đầu bằng hai lần bisect.
+    """
+
+    def __init__(self, keys=()):
+        ordered = sorted(keys)
+        self._chunks = [ordered[i:i + CHUNK_SIZE] for i in range(0, len(ordered), CHUNK_SIZE)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(ordered)
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._chunks):
+            return False
+        chunk = self._chunks[i]
+        j = bisect_left(chunk, key)
+        return j < len(chunk) and chunk[j] == key
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            return
+        i = min(bisect_left(self._maxes, key), len(self._chunks) - 1)
+        chunk = self._chunks[i]
+        j = bisect_left(chunk, key)
+        if j < len(chunk) and chunk[j] == key:
+            return
+        insort(chunk, key)
+        self._maxes[i] = chunk[-1]
+        self._len += 1
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self._chunks[i:i + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self._maxes[i:i + 1] = [chunk[CHUNK_SIZE - 1], chunk[-1]]
+
+    def discard(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._chunks):
+            return
+        chunk = self._chunks[i]
+        j = bisect_left(chunk, key)
+        if j == len(chunk) or chunk[j] != key:
+            return
+        del chunk[j]
+        self._len -= 1
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i]
+            del self._maxes[i]
+
+    def irange(self, start=None, end=None, after=None):
+        """Duyệt lười các key trong [start, end), bỏ qua các key <= after."""
+        if after is not None and (start is None or after >= start):
+            i = bisect_right(self._maxes, after)
+            locate = bisect_right
+            low = after
+        elif start is not None:
+            i = bisect_left(self._maxes, start)
+            locate = bisect_left
+            low = start
+        else:
+            i, locate, low = 0, None, None
+
+        for chunk in self._chunks[i:]:
+            j = locate(chunk, low) if locate is not None else 0
+            locate = None
+            for key in chunk[j:] if j else chunk:
+                if end is not None and key >= end:
+                    return
+                yield key
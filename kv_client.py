@@ -0,0 +1,235 @@
+import time
+import random
+import asyncio
+
+from router_node import get_responsible_nodes
+from connection_pool import ConnectionPool, RETRY_SAFE_ACTIONS
+from config import NODE_HOST, NODE_PORTS, BINARY_PROTOCOL, HEARTBEAT_INTERVAL, SCAN_DEFAULT_LIMIT
+from config import STATUS_OK, STATUS_ERROR, STATUS_NOT_FOUND, STATUS_QUORUM_NOT_MET
+
+
+class KVError(Exception):
+    """Node trả về STATUS_ERROR."""
+
+
+class KVQuorumNotMet(KVError):
+    """Lần ghi đã vào primary nhưng chưa đủ WRITE_QUORUM replica ack."""
+
+
+class KVUnavailable(KVError):
+    """Không node nào trong danh sách trả lời được sau khi đã retry."""
+
+
+class KVClient:
+    """Client async dùng lại được cho KV store.
+
+    - Mỗi node có một ConnectionPool pipelined, sống suốt vòng đời client.
+    - Lệnh theo key được gửi thẳng tới primary (get_responsible_nodes), rồi
+      tới các replica nếu primary không trả lời.
+    - Trạng thái sống/chết của node được làm mới qua action `get_status`
+      mỗi `status_interval` giây (chạy nền, không chặn lệnh).
+    - Lỗi kết nối / timeout được retry `retries` lần với backoff luỹ thừa, chỉ
+      với lệnh gửi lại được (RETRY_SAFE_ACTIONS). Lệnh ghi chỉ chuyển sang node
+      khác khi kết nối bị từ chối (chưa gửi gì); lỗi sau đó -> KVUnavailable,
+      vì lần gửi đầu có thể đã được áp dụng.
+
+    Dùng:
+        async with KVClient() as kv:
+            await kv.put("name", "Alice")
+            print(await kv.get("name"))
+    """
+
+    def __init__(self, host=NODE_HOST, ports=NODE_PORTS, timeout=5, retries=2, backoff=0.05,
+                 binary=BINARY_PROTOCOL, status_interval=HEARTBEAT_INTERVAL):
+        self.host = host
+        self.ports = list(ports)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.status_interval = status_interval
+        self._pools = {port: ConnectionPool(host, port, binary=binary) for port in self.ports}
+        self._down = {}             # port -> thời điểm (monotonic) được thử lại
+        self._statuses = {}         # port -> "ALIVE" / "DEAD" theo get_status
+        self._status_checked = 0.0
+        self._status_task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._status_task is not None:
+            self._status_task.cancel()
+        for pool in self._pools.values():
+            pool.close()
+
+    # --- Liveness ---
+
+    def _mark_down(self, port):
+        self._down[port] = time.monotonic() + self.status_interval
+
+    def is_alive(self, port):
+        if self._down.get(port, 0) > time.monotonic():
+            return False
+        return self._statuses.get(port, "ALIVE") == "ALIVE"
+
+    async def refresh_status(self):
+        """Hỏi get_status từ một node trả lời được và cập nhật trạng thái các node."""
+        self._status_checked = time.monotonic()
+        for port in sorted(self.ports, key=lambda p: not self.is_alive(p)):
+            try:
+                response = await self._pools[port].request({"action": "get_status"}, timeout=self.timeout)
+            except (ConnectionError, OSError, asyncio.TimeoutError):
+                self._mark_down(port)
+                continue
+            if response.get("status") == STATUS_OK:
+                self._statuses = {int(p): s for p, s in response.get("data", {}).items()}
+                self._down.pop(port, None)
+                return self._statuses
+        return self._statuses
+
+    def _maybe_refresh_status(self):
+        if time.monotonic() - self._status_checked < self.status_interval:
+            return
+        if self._status_task is None or self._status_task.done():
+            self._status_task = asyncio.create_task(self.refresh_status())
+
+    def _candidates(self, nodes):
+        # Node đang sống trước, giữ nguyên thứ tự preference list
+        return sorted(nodes, key=lambda p: not self.is_alive(p))
+
+    # --- Gửi lệnh ---
+
+    async def request(self, port, command):
+        """Gửi một lệnh tới đúng một node, không retry."""
+        return await self._pools[port].request(command, timeout=self.timeout)
+
+    async def call(self, nodes, command):
+        """Gửi lệnh tới node đầu tiên trả lời được trong `nodes`, có retry + backoff."""
+        self._maybe_refresh_status()
+        retry_safe = command.get("action") in RETRY_SAFE_ACTIONS
+        last_error = None
+        for attempt in range(self.retries + 1):
+            for port in self._candidates(nodes):
+                try:
+                    response = await self.request(port, command)
+                except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                    self._mark_down(port)
+                    last_error = e
+                    if not retry_safe and not isinstance(e, ConnectionRefusedError):
+                        raise KVUnavailable(f"{command.get('action')} to node {port} failed and may "
+                                            f"have been applied; not retrying: {e or type(e).__name__}") from e
+                    continue
+                self._down.pop(port, None)
+                return response
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        raise KVUnavailable(f"All nodes {list(nodes)} failed or unreachable: {last_error}")
+
+    async def call_key(self, key, command):
+        return await self.call(get_responsible_nodes(key), command)
+
+    async def pipeline(self, commands):
+        """Gửi nhiều lệnh theo key cùng lúc (pipelined trên các pool).
+
+        Trả về danh sách response theo thứ tự lệnh; lệnh lỗi cho ra Exception.
+        """
+        return await asyncio.gather(
+            *[self.call_key(c["key"], c) if "key" in c else self.call(self.ports, c) for c in commands],
+            return_exceptions=True
+        )
+
+    @staticmethod
+    def _check(response):
+        if response.get("status") == STATUS_QUORUM_NOT_MET:
+            raise KVQuorumNotMet(response.get("message", "Write quorum not met"))
+        if response.get("status") not in (STATUS_OK, STATUS_NOT_FOUND):
+            raise KVError(response.get("message", "Unknown error"))
+        return response
+
+    # --- API theo key ---
+
+    async def get_record(self, key):
+        """Record {"value", "version", ...} của key, hoặc None nếu không có."""
+        response = self._check(await self.call_key(key, {"action": "get", "key": key}))
+        return response.get("value") if response.get("status") == STATUS_OK else None
+
+    async def get(self, key, default=None):
+        record = await self.get_record(key)
+        return record.get("value") if record is not None else default
+
+    async def put(self, key, value, ttl=None):
+        command = {"action": "put", "key": key, "value": value}
+        if ttl is not None:
+            command["ttl"] = ttl
+        return self._check(await self.call_key(key, command))
+
+    async def delete(self, key):
+        return self._check(await self.call_key(key, {"action": "delete", "key": key}))
+
+    # --- Batch ---
+
+    async def _batch(self, keys, build):
+        """Nhóm key theo preference list, gửi mỗi nhóm một message song song."""
+        groups = {}
+        for key in keys:
+            groups.setdefault(tuple(get_responsible_nodes(key)), []).append(key)
+
+        async def send_group(nodes, group_keys):
+            try:
+                response = self._check(await self.call(nodes, build(group_keys)))
+                return response.get("results", {})
+            except KVError as e:
+                return {k: {"status": STATUS_ERROR, "message": str(e)} for k in group_keys}
+
+        results = {}
+        for part in await asyncio.gather(*[send_group(n, k) for n, k in groups.items()]):
+            results.update(part)
+        return results
+
+    async def mget(self, keys):
+        """{key: kết quả theo từng key} như action mget trả về."""
+        return await self._batch(keys, lambda ks: {"action": "mget", "keys": ks})
+
+    async def mput(self, items, ttl=None):
+        def build(ks):
+            command = {"action": "mput", "items": {k: items[k] for k in ks}}
+            if ttl is not None:
+                command["ttl"] = ttl
+            return command
+        return await self._batch(list(items), build)
+
+    async def mdelete(self, keys):
+        return await self._batch(keys, lambda ks: {"action": "mdelete", "keys": ks})
+
+    # --- Duyệt ---
+
+    async def scan(self, port, prefix=None, include_deleted=False, limit=SCAN_DEFAULT_LIMIT):
+        """Duyệt dữ liệu local của một node; yield (key, record)."""
+        cursor = None
+        while True:
+            response = self._check(await self.call([port], {
+                "action": "scan", "cursor": cursor, "limit": limit,
+                "prefix": prefix, "include_deleted": include_deleted
+            }))
+            for item in response.get("data", {}).items():
+                yield item
+            cursor = response.get("cursor")
+            if not cursor:
+                return
+
+    async def range(self, start=None, end=None, prefix=None, limit=SCAN_DEFAULT_LIMIT):
+        """Range query toàn cluster theo thứ tự key; yield (key, record)."""
+        cursor = None
+        while True:
+            response = self._check(await self.call(self.ports, {
+                "action": "range", "start": start, "end": end, "prefix": prefix,
+                "limit": limit, "cursor": cursor
+            }))
+            for item in response.get("data", {}).items():
+                yield item
+            cursor = response.get("cursor")
+            if not cursor:
+                return
@@ -0,0 +1,105 @@
+import hashlib
+
+from router_node import get_replica_group
+from config import MERKLE_FANOUT, MERKLE_DEPTH
+
+NUM_BUCKETS = MERKLE_FANOUT ** MERKLE_DEPTH
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.sha1(data).digest()[:8], "big")
+
+
+def bucket_of(key):
+    return _hash64(key.encode()) % NUM_BUCKETS
+
+
+def leaf_hash(key, record):
+    return _hash64(f"{key}\0{record.version}\0{record.deleted}".encode())
+
+
+def group_of(key):
+    """Key range của key = tập replica chịu trách nhiệm cho nó (đã sort)."""
+    return get_replica_group(key)
+
+
+def build_levels(leaves):
+    """Các tầng của cây từ root (tầng 0) tới lá, từ digest của các bucket lá."""
+    level = list(leaves)
+    levels = [level]
+    while len(level) > 1:
+        level = [
+            _hash64(b"".join(h.to_bytes(8, "big") for h in level[i:i + MERKLE_FANOUT]))
+            for i in range(0, len(level), MERKLE_FANOUT)
+        ]
+        levels.append(level)
+    levels.reverse()
+    return levels
+
+
+def hashes_at(levels, depth, indices):
+    level = levels[depth]
+    return {str(i): f"{level[i]:016x}" for i in indices if 0 <= i < len(level)}
+
+
+class MerkleIndex:
+    """Merkle tree cho từng key range, cập nhật tăng dần sau mỗi lần ghi.
+
+    Lá là các bucket băm; digest của bucket là XOR của hash (key, version,
+    deleted) nên thêm/xoá một record chỉ tốn O(1). Các tầng phía trên được
+    tính lại khi có node hỏi tới, với fan-out MERKLE_FANOUT.
+    """
+
+    def __init__(self):
+        self.buckets = {}       # group -> [digest] * NUM_BUCKETS
+        self.bucket_keys = {}   # group -> {bucket -> set(key)}
+        self._levels = {}       # group -> cache các tầng của cây
+
+    def rebuild(self, store):
+        self.buckets.clear()
+        self.bucket_keys.clear()
+        self._levels.clear()
+        for key, record in store.items():
+            self.update(key, None, record)
+
+    def update(self, key, old_record, new_record):
+        group = group_of(key)
+        bucket = bucket_of(key)
+        digests = self.buckets.get(group)
+        if digests is None:
+            digests = self.buckets[group] = [0] * NUM_BUCKETS
+            self.bucket_keys[group] = {}
+        if old_record is not None:
+            digests[bucket] ^= leaf_hash(key, old_record)
+        if new_record is not None:
+            digests[bucket] ^= leaf_hash(key, new_record)
+            self.bucket_keys[group].setdefault(bucket, set()).add(key)
+        else:
+            keys = self.bucket_keys[group].get(bucket)
+            if keys is not None:
+                keys.discard(key)
+        self._levels.pop(group, None)
+
+    def levels(self, group):
+        """Trả về các tầng từ root (tầng 0) tới lá (tầng MERKLE_DEPTH)."""
+        group = tuple(group)
+        cached = self._levels.get(group)
+        if cached is not None:
+            return cached
+
+        levels = self._levels[group] = build_levels(self.leaves(group))
+        return levels
+
+    def leaves(self, group):
+        """Digest của các bucket lá (bản sao) của một key range."""
+        return list(self.buckets.get(tuple(group), [0] * NUM_BUCKETS))
+
+    def node_hashes(self, group, depth, indices):
+        return hashes_at(self.levels(group), depth, indices)
+
+    def keys_in_buckets(self, group, buckets):
+        by_bucket = self.bucket_keys.get(tuple(group), {})
+        keys = []
+        for bucket in buckets:
+            keys.extend(by_bucket.get(bucket, ()))
+        return keys
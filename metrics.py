@@ -0,0 +1,275 @@
+import time
+import bisect
+import asyncio
+import threading
+from contextlib import contextmanager
+
+from config import METRICS_SIGNIFICANT_BITS, METRICS_BUCKETS
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    """Bộ đếm chỉ tăng. Chỉ được cập nhật từ event loop; nếu có `func` thì
+    giá trị được đọc từ bộ đếm sẵn có của đối tượng khác."""
+
+    def __init__(self, func=None):
+        self.value = 0
+        self.func = func
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.func() if self.func is not None else self.value
+
+
+class Gauge:
+    """Giá trị tức thời; nếu có `func` thì đọc lại mỗi lần xuất."""
+
+    def __init__(self, func=None):
+        self.value = 0
+        self.func = func
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def snapshot(self):
+        return self.func() if self.func is not None else self.value
+
+
+class Histogram:
+    """Histogram kiểu HDR: bucket log-tuyến tính trên micro giây.
+
+    Giá trị < 2**bits được đếm chính xác; phía trên, mỗi luỹ thừa của 2 chia
+    thành 2**(bits-1) bucket đều nhau, nên sai số tương đối của percentile
+    <= 2**-(bits-1) (bits=6 -> ~3%) với bộ nhớ chỉ tỉ lệ với số bucket có dữ
+    liệu. Có lock vì persistence worker cũng ghi vào (thread riêng).
+    """
+
+    def __init__(self, bits=METRICS_SIGNIFICANT_BITS, bounds=METRICS_BUCKETS):
+        self.bits = bits
+        self.half = 1 << (bits - 1)
+        self.bounds = tuple(bounds)
+        self.le_counts = [0] * len(self.bounds)   # bucket Prometheus, đếm chính xác lúc observe
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _index(self, micros):
+        if micros < (1 << self.bits):
+            return micros
+        shift = micros.bit_length() - self.bits
+        return shift * self.half + (micros >> shift)
+
+    def _bounds(self, index):
+        """[thấp, cao) của bucket, tính bằng micro giây."""
+        if index < (1 << self.bits):
+            return index, index + 1
+        shift = index // self.half - 1
+        mantissa = index - shift * self.half
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def observe(self, seconds):
+        index = self._index(max(int(seconds * 1e6), 0))
+        le = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            if le < len(self.le_counts):
+                self.le_counts[le] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _buckets(self):
+        with self._lock:
+            return sorted(self.counts.items()), self.count, self.sum, self.max
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99, 0.999)):
+        buckets, count, _, _ = self._buckets()
+        result = {}
+        for q in quantiles:
+            if not count:
+                result[q] = 0.0
+                continue
+            rank = q * count
+            seen = 0
+            for index, n in buckets:
+                seen += n
+                if seen >= rank:
+                    low, high = self._bounds(index)
+                    result[q] = (low + high) / 2 / 1e6
+                    break
+        return result
+
+    def cumulative(self):
+        """[(le, số mẫu <= le)] cho định dạng Prometheus. Mỗi mẫu được đếm lúc
+        observe vào `le` đầu tiên >= giá trị của nó (không qua bucket HDR)."""
+        with self._lock:
+            le_counts, count, total = list(self.le_counts), self.count, self.sum
+        result, seen = [], 0
+        for le, n in zip(self.bounds, le_counts):
+            seen += n
+            result.append((le, seen))
+        return result, count, total
+
+    def snapshot(self):
+        p = self.percentiles()
+        return {
+            "count": self.count, "sum": round(self.sum, 6), "max": round(self.max, 6),
+            "p50": p[0.5], "p95": p[0.95], "p99": p[0.99], "p999": p[0.999]
+        }
+
+
+class MetricsRegistry:
+    """Registry trong tiến trình: mỗi metric là một họ (name, type, help) gồm
+    các series theo bộ label.
+
+        metrics.counter("kv_requests_total", "...", action="put").inc()
+        with metrics.histogram("kv_request_seconds", "...", action="put").time():
+            ...
+    """
+
+    KINDS = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+
+    def __init__(self):
+        self._families = {}    # name -> (kind, help, {labels: metric})
+        self.labels = ()       # label gắn vào mọi series khi xuất Prometheus, vd (("worker", "1"),)
+        self._lock = threading.Lock()   # chỉ khi tạo series mới (persistence worker cũng tạo)
+
+    def _get(self, kind, name, help, labels):
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        metric = family[2].get(key) if family is not None else None
+        if metric is None:
+            with self._lock:
+                family = self._families.setdefault(name, (kind, help, {}))
+                if family[0] != kind:
+                    raise ValueError(f"Metric {name} đã được đăng ký là {family[0]}")
+                metric = family[2].setdefault(key, self.KINDS[kind]())
+        return metric
+
+    def _families_sorted(self):
+        with self._lock:
+            return [(name, kind, help, sorted(series.items()))
+                    for name, (kind, help, series) in sorted(self._families.items())]
+
+    def counter(self, name, help="", func=None, **labels):
+        counter = self._get("counter", name, help, labels)
+        if func is not None:
+            counter.func = func
+        return counter
+
+    def gauge(self, name, help="", func=None, **labels):
+        gauge = self._get("gauge", name, help, labels)
+        if func is not None:
+            gauge.func = func
+        return gauge
+
+    def histogram(self, name, help="", **labels):
+        return self._get("histogram", name, help, labels)
+
+    def snapshot(self):
+        """Dạng dict cho action `metrics`: {name: [{"labels": ..., "value": ...}]}."""
+        result = {}
+        for name, _, _, series in self._families_sorted():
+            result[name] = [{"labels": dict(labels), "value": metric.snapshot()} for labels, metric in series]
+        return result
+
+    def render_prometheus(self):
+        lines = []
+        for name, kind, help, series in self._families_sorted():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in series:
+                labels = tuple(self.labels) + labels
+                if kind != "histogram":
+                    lines.append(f"{name}{_label_text(labels)} {metric.snapshot()}")
+                    continue
+                buckets, count, total = metric.cumulative()
+                for le, n in buckets:
+                    lines.append(f"{name}_bucket{_label_text(labels, [('le', le)])} {n}")
+                lines.append(f"{name}_bucket{_label_text(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{_label_text(labels)} {total}")
+                lines.append(f"{name}_count{_label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Mỗi node (hoặc mỗi worker của node) là một tiến trình nên dùng chung một registry
+metrics = MetricsRegistry()
+
+
+def merge_prometheus(texts):
+    """Gộp output Prometheus của nhiều registry (các worker của một node):
+    mỗi metric chỉ giữ một cặp HELP/TYPE, series của mọi registry nằm liền nhau."""
+    families = {}   # name -> [dòng HELP, dòng TYPE, các sample]
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split(" ", 3)[2]
+                families.setdefault(name, [line, None, []])
+            elif line.startswith("# TYPE "):
+                families[name][1] = families[name][1] or line
+            elif line:
+                families[name][2].append(line)
+    return "".join("\n".join([help, kind] + samples) + "\n" for help, kind, samples in families.values())
+
+
+async def _serve_http(reader, writer, render):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", (await render()).encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.TimeoutError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _render_local():
+    return metrics.render_prometheus()
+
+
+async def start_metrics_server(host, port, render=None):
+    """HTTP listener tối giản cho Prometheus: GET /metrics (nội dung do `render` trả về)."""
+    render = render or _render_local
+    return await asyncio.start_server(lambda r, w: _serve_http(r, w, render), host, port)
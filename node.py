@@ -1,11 +1,20 @@
+import os
+import sys
+import time
 import asyncio
 import argparse
-import json
 import logging
+import signal
+import multiprocessing
+import multiprocessing.connection
 
 from store_node import KVStore
 from action_node import KVNodeLogic
 from heartbeat_node import HeartbeatManager
+from connection_pool import close_all_pools
+from protocol import accept_stream, ProtocolError
+from metrics import metrics, start_metrics_server
+from worker_pool import WorkerRouter, worker_store_file, repartition
 from config import *
 
 # Thiết lập logging
@@ -17,36 +26,89 @@ def make_logger(name):
         print(f"{name} {msg}", flush=True)
     return log
 
+def node_store_file(port):
+    return f"data/store_kv_node_{port - 8887}.json"
+
 class KVNode:
-    def __init__(self, host, port, log_callback=None):
+    def __init__(self, host, port, log_callback=None, durability=DURABILITY_MODE, commit_window_ms=GROUP_COMMIT_WINDOW_MS,
+                 worker_id=0, workers=1):
         self.host = host
         self.port = port
-        self.store_file = f"data/store_kv_node_{port - 8887}.json"
-        self.kv = KVStore(self.store_file)
+        self.worker_id = worker_id
+        self.workers = workers
+        self.store_file = worker_store_file(node_store_file(port), worker_id, workers)
+        # Store được load trong start() trên persistence worker
+        self.kv = KVStore(self.store_file, durability, commit_window_ms, load=False)
         self.log_callback = log_callback or make_logger(f"[Node {self.port}]")
         self.logic = KVNodeLogic(self.kv, self.port, self.log_callback)
+        self.router = None
+        if workers > 1:
+            # Mỗi worker giữ một phần keyspace local; lệnh tới nhầm worker được chuyển tiếp
+            self.router = self.logic.workers = WorkerRouter(self.logic, port, worker_id, workers)
+            metrics.labels = (("worker", str(worker_id)),)
+        self.handler = self.router.handle if self.router else self.logic.handle
+
+    async def _process(self, message, addr):
+        try:
+            return await self.handler(message)
+        except Exception as e:
+            logger.debug(f"[Node {self.port}] Error handling request from {addr}: {e}")
+            return {"status": STATUS_ERROR, "message": f"Error: {str(e)}"}
+
+    async def _process_tagged(self, stream, write_lock, message, addr):
+        # Request có "id": trả lời ngay khi xong, không cần theo thứ tự
+        response = dict(await self._process(message, addr))
+        response["id"] = message["id"]
+        async with write_lock:
+            await stream.send(response)
 
     async def handle_client(self, reader, writer):
         addr = writer.get_extra_info('peername')
         logger.debug(f"[Node {self.port}] Connected by {addr}")
+        connections = metrics.gauge("kv_client_connections", "Số kết nối đang mở")
+        connections.inc()
+        metrics.counter("kv_connections_total", "Số kết nối đã nhận").inc()
 
+        inflight = set()
+        slots = asyncio.Semaphore(MAX_INFLIGHT_PER_CONNECTION)
+        write_lock = asyncio.Lock()
         try:
-            while True:
-                data = await reader.readline()
-                if not data:
-                    break
-
+            # JSON theo dòng hoặc frame nhị phân, tuỳ byte đầu tiên client gửi
+            stream = await accept_stream(reader, writer)
+            while stream is not None:
                 try:
-                    message = json.loads(data.decode())
-                    response = await self.logic.handle(message)
+                    message = await stream.read_message()
+                except (ConnectionError, asyncio.IncompleteReadError, ProtocolError):
+                    break
                 except Exception as e:
-                    logger.debug(f"[Node {self.port}] Error handling request from {addr}: {e}")
-                    response = {"status": STATUS_ERROR, "message": f"Error: {str(e)}"}
+                    metrics.counter("kv_bad_messages_total", "Message không đọc được").inc()
+                    message = {"status": STATUS_ERROR, "message": f"Error: {str(e)}"}
+                    async with write_lock:
+                        await stream.send(message)
+                    continue
+                if message is None:
+                    break
+
+                if isinstance(message, dict) and "id" in message:
+                    await slots.acquire()
+                    task = asyncio.create_task(self._process_tagged(stream, write_lock, message, addr))
+                    inflight.add(task)
+                    task.add_done_callback(inflight.discard)
+                    task.add_done_callback(lambda _: slots.release())
+                    continue
 
-                writer.write((json.dumps(response) + "\n").encode())
-                await writer.drain()
+                response = await self._process(message, addr)
+                async with write_lock:
+                    await stream.send(response)
 
+            if inflight:
+                await asyncio.gather(*inflight, return_exceptions=True)
+        except Exception as e:
+            logger.debug(f"[Node {self.port}] Connection error from {addr}: {e}")
         finally:
+            connections.dec()
+            for task in inflight:
+                task.cancel()
             writer.close()
             try:
                 await writer.wait_closed()
@@ -55,11 +117,27 @@ class KVNode:
             logger.debug(f"[Node {self.port}] Disconnected: {addr}")
 
     async def start(self):
-        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        started = time.perf_counter()
+        await self.kv.load_store_async()
+        self.log_callback(f"loaded {len(self.kv.store)} keys in {time.perf_counter() - started:.2f}s")
+        # Các worker của một node cùng nghe trên một port; kernel chia kết nối cho chúng
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=MAX_FRAME_BYTES,
+                                                 reuse_port=self.workers > 1)
+        if self.router:
+            await self.router.start_server(self.handle_client)
         self.log_callback(f"started at {self.host}:{self.port}")
+        if METRICS_PORT_OFFSET and self.worker_id == 0:
+            self.metrics_server = await start_metrics_server(
+                self.host, self.port + METRICS_PORT_OFFSET, render=self.router.render_metrics if self.router else None)
+            self.log_callback(f"metrics at http://{self.host}:{self.port + METRICS_PORT_OFFSET}/metrics")
 
-        # Bắt đầu sync dữ liệu sau khi server khởi động
-        asyncio.create_task(self.sync_missing_data())
+        # Bắt đầu sync dữ liệu sau khi server khởi động (một worker sync cho cả node)
+        if self.worker_id == 0:
+            asyncio.create_task(self.sync_missing_data())
+        # Gửi bù các lần ghi mà replica đã bỏ lỡ khi chúng sống lại
+        asyncio.create_task(self.logic.handoff.run())
+        asyncio.create_task(self.expire_keys())
+        asyncio.create_task(self.collect_tombstones())
 
         try:
             async with self.server:
@@ -72,40 +150,109 @@ class KVNode:
         self.log_callback("Syncing missing data after recovery...")
         await self.logic.sync_missing_data()
 
+    async def expire_keys(self):
+        """Expirer chủ động: mỗi tick chỉ xử lý các key mà timer wheel báo tới hạn."""
+        while True:
+            await asyncio.sleep(TTL_WHEEL_TICK)
+            expired = self.kv.expire_due()
+            if expired:
+                await self.kv.commit()
+                logger.debug(f"[Node {self.port}] Expired {expired} key(s)")
+
+    async def collect_tombstones(self):
+        while True:
+            await asyncio.sleep(TOMBSTONE_GC_INTERVAL)
+            try:
+                await self.logic.collect_tombstones()
+            except Exception as e:
+                self.log_callback(f"Tombstone GC failed: {e}")
+
     async def stop(self):
         if hasattr(self, 'server'):
             self.server.close()
             await self.server.wait_closed()
+            if getattr(self, 'metrics_server', None) is not None:
+                self.metrics_server.close()
+            close_all_pools()
+            if self.router:
+                self.router.close()
+            self.logic.handoff.close()
+            self.kv.close()
             self.log_callback("stopped")
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--port", type=int, required=True)
-    args = parser.parse_args()
-
-    node_logger = make_logger(f"[Node {args.port}]")
-    heartbeat_logger = make_logger(f"[Heartbeat {args.port}]")
-
+def run_node(port, durability, commit_window_ms, worker_id=0, workers=1):
+    """Chạy một node (hoặc một worker của node) tới khi bị dừng."""
+    name = f"Node {port}" if workers == 1 else f"Node {port}/w{worker_id}"
     node = KVNode(
         host=NODE_HOST,
-        port=args.port,
-        log_callback=node_logger
+        port=port,
+        log_callback=make_logger(f"[{name}]"),
+        durability=durability,
+        commit_window_ms=commit_window_ms,
+        worker_id=worker_id,
+        workers=workers
     )
 
-    heartbeat = HeartbeatManager(
-        port=args.port,
-        log_callback=heartbeat_logger
-    )
+    async def watch_parent(parent_pid):
+        # Supervisor bị kill (kể cả SIGKILL) thì worker cũng dừng, không giữ port một mình
+        while os.getppid() == parent_pid:
+            await asyncio.sleep(0.5)
+        os._exit(1)
 
     async def main():
-        await asyncio.gather(
-            node.start(),
-            heartbeat.start()
-        )
+        tasks = [node.start()]
+        if workers > 1:
+            tasks.append(watch_parent(os.getppid()))
+        # Cả node chỉ có một danh tính heartbeat: worker 0 gửi/nhận và báo lại cho các worker khác
+        if worker_id == 0:
+            heartbeat = HeartbeatManager(
+                port=port,
+                log_callback=make_logger(f"[Heartbeat {port}]"),
+                on_heartbeat=node.router.broadcast_heartbeat if node.router else None
+            )
+            tasks.append(heartbeat.start())
+        await asyncio.gather(*tasks)
 
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print(f"\n[Node {args.port}] Ctrl+C received. Exiting...", flush=True)
-        import sys
-        sys.exit(0)
\ No newline at end of file
+        if worker_id == 0:
+            print(f"\n[Node {port}] Ctrl+C received. Exiting...", flush=True)
+        sys.exit(0)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--durability", choices=["always", "batch-ms", "none"], default=DURABILITY_MODE,
+                        help="fsync policy cho các lần ghi của node")
+    parser.add_argument("--commit-window-ms", type=float, default=GROUP_COMMIT_WINDOW_MS,
+                        help="cửa sổ group commit khi --durability=batch-ms")
+    parser.add_argument("--workers", type=int, default=NODE_WORKERS,
+                        help="số worker process cùng nghe trên port (SO_REUSEPORT), chia keyspace local theo hash")
+    args = parser.parse_args()
+    workers = max(args.workers, 1)
+
+    # Số worker đổi so với lần chạy trước -> chia lại dữ liệu local trước khi mở port
+    repartition(node_store_file(args.port), workers, make_logger(f"[Node {args.port}]"))
+
+    if workers == 1:
+        run_node(args.port, args.durability, args.commit_window_ms)
+    else:
+        processes = [
+            multiprocessing.Process(target=run_node, name=f"node-{args.port}-w{i}",
+                                    args=(args.port, args.durability, args.commit_window_ms, i, workers))
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            multiprocessing.connection.wait([process.sentinel for process in processes])
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        # Một worker chết thì cả node dừng, để không phục vụ thiếu một phần keyspace
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
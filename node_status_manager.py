@@ -1,22 +1,89 @@
+import math
 import time
+from collections import deque
+
+from config import HEARTBEAT_INTERVAL, PHI_WINDOW_SIZE, PHI_MIN_STD, PHI_ACCEPTABLE_PAUSE, PHI_THRESHOLD_ROUTING
+
+
+class ArrivalWindow:
+    """Lịch sử khoảng cách giữa các heartbeat của một node (thời gian monotonic)."""
+
+    def __init__(self, now):
+        self.last = now
+        # Chưa có mẫu nào thì giả định heartbeat đều đặn theo HEARTBEAT_INTERVAL
+        self.intervals = deque([HEARTBEAT_INTERVAL], maxlen=PHI_WINDOW_SIZE)
+        self._sum = HEARTBEAT_INTERVAL
+        self._sum_sq = HEARTBEAT_INTERVAL ** 2
+
+    def add(self, interval):
+        if len(self.intervals) == self.intervals.maxlen:
+            old = self.intervals[0]
+            self._sum -= old
+            self._sum_sq -= old * old
+        self.intervals.append(interval)
+        self._sum += interval
+        self._sum_sq += interval * interval
+
+    def phi(self, now):
+        n = len(self.intervals)
+        mean = self._sum / n + PHI_ACCEPTABLE_PAUSE
+        std = max(math.sqrt(max(self._sum_sq / n - (self._sum / n) ** 2, 0.0)), PHI_MIN_STD)
+        # Xấp xỉ logistic của phân phối chuẩn (như Akka / Cassandra)
+        y = (now - self.last - mean) / std
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y)) if y > -30 else math.inf
+        if y > 0:
+            p_later = e / (1.0 + e)
+        else:
+            p_later = 1.0 - 1.0 / (1.0 + e)
+        return -math.log10(p_later) if p_later > 0 else math.inf
+
 
 class NodeStatusManager:
+    """Phi-accrual failure detector.
+
+    Thay vì một timeout cố định, mỗi node có mức nghi ngờ `phi` tính từ lịch sử
+    khoảng cách heartbeat của chính nó; nơi gọi tự chọn ngưỡng phi phù hợp
+    (PHI_THRESHOLD_ROUTING, PHI_THRESHOLD_SYNC, ...).
+    """
+
     def __init__(self):
-        self.last_seen = {}
+        self.windows = {}
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """callback(node_id) được gọi khi một node chuyển sang ALIVE (lần đầu hoặc sau khi DEAD)."""
+        self.listeners.append(callback)
 
     def update(self, node_id):
-        self.last_seen[node_id] = time.time()
+        now = time.monotonic()
+        window = self.windows.get(node_id)
+        if window is None:
+            self.windows[node_id] = ArrivalWindow(now)
+            came_back = True
+        else:
+            came_back = window.phi(now) >= PHI_THRESHOLD_ROUTING
+            # Khoảng lặng của một lần DEAD không phải mẫu của nhịp heartbeat bình thường
+            if not came_back:
+                window.add(now - window.last)
+            window.last = now
+        if came_back:
+            for callback in self.listeners:
+                callback(node_id)
+
+    def phi(self, node_id):
+        """Mức nghi ngờ node đã chết; inf nếu chưa từng nghe thấy."""
+        window = self.windows.get(node_id)
+        return window.phi(time.monotonic()) if window else math.inf
 
-    def is_alive(self, node_id, timeout=5):
-        last = self.last_seen.get(node_id)
-        return last is not None and (time.time() - last < timeout)
+    def is_alive(self, node_id, threshold=PHI_THRESHOLD_ROUTING):
+        return self.phi(node_id) < threshold
 
-    def get_all_statuses(self, timeout=5):
-        now = time.time()
+    def get_all_statuses(self, threshold=PHI_THRESHOLD_ROUTING):
+        now = time.monotonic()
         return {
-            node_id: ("ALIVE" if now - ts < timeout else "DEAD")
-            for node_id, ts in self.last_seen.items()
+            node_id: ("ALIVE" if window.phi(now) < threshold else "DEAD")
+            for node_id, window in self.windows.items()
         }
 
 # Singleton instance để module khác import dùng chung
-node_status_manager = NodeStatusManager()
\ No newline at end of file
+node_status_manager = NodeStatusManager()
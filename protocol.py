@@ -0,0 +1,270 @@
+import json
+import base64
+import struct
+import asyncio
+
+from config import BINARY_PROTOCOL, MAX_FRAME_BYTES
+
+# Byte đầu tiên của một kết nối JSON luôn là '{' nên client muốn dùng frame
+# nhị phân chỉ cần mở đầu kết nối bằng MAGIC.
+MAGIC = b"\x00KVB"
+
+# --- Tag của định dạng nhị phân ---
+_NONE, _TRUE, _FALSE = b"N", b"T", b"F"
+_INT, _BIGINT, _FLOAT = b"i", b"j", b"d"
+_STR, _BYTES, _LIST, _DICT = b"s", b"b", b"l", b"m"
+
+(_T_NONE, _T_TRUE, _T_FALSE, _T_INT, _T_BIGINT, _T_FLOAT,
+ _T_STR, _T_BYTES, _T_LIST, _T_DICT) = (t[0] for t in (
+    _NONE, _TRUE, _FALSE, _INT, _BIGINT, _FLOAT, _STR, _BYTES, _LIST, _DICT))
+
+_U32 = struct.Struct(">I")
+_I64 = struct.Struct(">q")
+_F64 = struct.Struct(">d")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _encode(obj, out):
+    if obj is None:
+        out.append(_NONE)
+    elif obj is True:
+        out.append(_TRUE)
+    elif obj is False:
+        out.append(_FALSE)
+    elif isinstance(obj, int):
+        if -(1 << 63) <= obj < (1 << 63):
+            out.append(_INT)
+            out.append(_I64.pack(obj))
+        else:
+            raw = str(obj).encode()
+            out.append(_BIGINT)
+            out.append(_U32.pack(len(raw)))
+            out.append(raw)
+    elif isinstance(obj, float):
+        out.append(_FLOAT)
+        out.append(_F64.pack(obj))
+    elif isinstance(obj, str):
+        raw = obj.encode("utf-8")
+        out.append(_STR)
+        out.append(_U32.pack(len(raw)))
+        out.append(raw)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        out.append(_BYTES)
+        out.append(_U32.pack(len(obj)))
+        out.append(bytes(obj) if isinstance(obj, memoryview) else obj)
+    elif isinstance(obj, (list, tuple)):
+        out.append(_LIST)
+        out.append(_U32.pack(len(obj)))
+        for item in obj:
+            _encode(item, out)
+    elif isinstance(obj, dict):
+        out.append(_DICT)
+        out.append(_U32.pack(len(obj)))
+        for k, v in obj.items():
+            _encode(k, out)
+            _encode(v, out)
+    else:
+        raise ProtocolError(f"Cannot encode {type(obj).__name__}")
+
+
+def _decode(mv, pos):
+    if pos >= len(mv):
+        raise ProtocolError("Truncated frame")
+    tag = mv[pos]
+    pos += 1
+    if tag == _T_NONE:
+        return None, pos
+    if tag == _T_TRUE:
+        return True, pos
+    if tag == _T_FALSE:
+        return False, pos
+    if tag == _T_INT:
+        return _I64.unpack_from(mv, pos)[0], pos + 8
+    if tag == _T_FLOAT:
+        return _F64.unpack_from(mv, pos)[0], pos + 8
+    if tag in (_T_STR, _T_BYTES, _T_BIGINT):
+        size = _U32.unpack_from(mv, pos)[0]
+        pos += 4
+        chunk = mv[pos:pos + size]
+        if len(chunk) != size:
+            raise ProtocolError("Truncated frame")
+        if tag == _T_STR:
+            return str(chunk, "utf-8"), pos + size
+        if tag == _T_BYTES:
+            return chunk.tobytes(), pos + size
+        return int(str(chunk, "ascii")), pos + size
+    if tag == _T_LIST:
+        count = _U32.unpack_from(mv, pos)[0]
+        pos += 4
+        items = []
+        for _ in range(count):
+            item, pos = _decode(mv, pos)
+            items.append(item)
+        return items, pos
+    if tag == _T_DICT:
+        count = _U32.unpack_from(mv, pos)[0]
+        pos += 4
+        result = {}
+        for _ in range(count):
+            k, pos = _decode(mv, pos)
+            v, pos = _decode(mv, pos)
+            result[k] = v
+        return result, pos
+    raise ProtocolError(f"Unknown tag {tag!r}")
+
+
+def encode_frame(message):
+    """Frame = 4 byte độ dài (big-endian) + payload nhị phân."""
+    parts = [b""]
+    _encode(message, parts)
+    payload_size = sum(len(p) for p in parts)
+    parts[0] = _U32.pack(payload_size)
+    return b"".join(parts)
+
+
+def decode_payload(payload):
+    """Giải mã payload qua memoryview: chỉ tạo ra các object str/bytes cuối cùng."""
+    try:
+        message, pos = _decode(memoryview(payload), 0)
+    except struct.error as e:
+        raise ProtocolError(f"Truncated frame: {e}")
+    if pos != len(payload):
+        raise ProtocolError("Trailing bytes in frame")
+    return message
+
+
+# --- JSON: giữ tương thích, bytes được bọc thành {"__bytes__": base64} ---
+#
+# Để dict của người dùng không bị nhầm với phong bì bytes, khoá "__bytes__",
+# "__bytes__~", "__bytes__~~"... của dữ liệu được thêm một "~" khi mã hoá và bỏ
+# bớt một "~" khi giải mã. Chỉ dữ liệu thật sự có khoá như vậy mới phải đi
+# đường chậm (duyệt cây để đổi khoá); các message khác vẫn một lần json.dumps.
+
+_BYTES_KEY = "__bytes__"
+
+
+def _reserved(key):
+    return isinstance(key, str) and key.startswith(_BYTES_KEY) and key.strip("~") == _BYTES_KEY
+
+
+def _escape_keys(obj):
+    if isinstance(obj, dict):
+        return {(k + "~" if _reserved(k) else k): _escape_keys(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_escape_keys(v) for v in obj]
+    return obj
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and _BYTES_KEY in obj:
+        return base64.b64decode(obj[_BYTES_KEY])
+    return obj
+
+
+def _json_object_hook_escaped(obj):
+    if len(obj) == 1 and _BYTES_KEY in obj:
+        return base64.b64decode(obj[_BYTES_KEY])
+    if any(_reserved(k) for k in obj):
+        return {(k[:-1] if _reserved(k) else k): v for k, v in obj.items()}
+    return obj
+
+
+def json_dumps(obj, **kwargs):
+    wrapped = 0
+
+    def default(value):
+        nonlocal wrapped
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            wrapped += 1
+            return {_BYTES_KEY: base64.b64encode(bytes(value)).decode("ascii")}
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    text = json.dumps(obj, default=default, **kwargs)
+    # Mỗi phong bì bytes sinh đúng một chuỗi "__bytes__; thừa ra nghĩa là dữ liệu có khoá dễ nhầm
+    if text.count(f'"{_BYTES_KEY}') > wrapped:
+        text = json.dumps(_escape_keys(obj), default=default, **kwargs)
+    return text
+
+
+def json_loads(data):
+    marker = f"{_BYTES_KEY}~" if isinstance(data, str) else f"{_BYTES_KEY}~".encode()
+    hook = _json_object_hook_escaped if marker in data else _json_object_hook
+    return json.loads(data, object_hook=hook)
+
+
+class MessageStream:
+    """Một kết nối đã thương lượng định dạng: JSON theo dòng hoặc frame nhị phân."""
+
+    def __init__(self, reader, writer, binary, prefix=b""):
+        self.reader = reader
+        self.writer = writer
+        self.binary = binary
+        self._prefix = prefix   # byte đã đọc trước khi biết định dạng
+
+    async def read_message(self):
+        """Trả về message tiếp theo, hoặc None khi peer đóng kết nối."""
+        if not self.binary:
+            data, self._prefix = self._prefix, b""
+            if not data.endswith(b"\n"):
+                data += await self.reader.readline()
+            return json_loads(data.decode()) if data else None
+        try:
+            header = await self.reader.readexactly(4)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise ConnectionError("Connection closed in the middle of a frame")
+        size = _U32.unpack(header)[0]
+        if size > MAX_FRAME_BYTES:
+            raise ProtocolError(f"Frame of {size} bytes exceeds MAX_FRAME_BYTES")
+        payload = await self.reader.readexactly(size)
+        return decode_payload(payload)
+
+    def write_message(self, message):
+        if self.binary:
+            self.writer.write(encode_frame(message))
+        else:
+            self.writer.write((json_dumps(message) + "\n").encode())
+
+    async def send(self, message):
+        self.write_message(message)
+        await self.writer.drain()
+
+    def at_eof(self):
+        return self.reader.at_eof()
+
+    def is_closing(self):
+        return self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+    async def wait_closed(self):
+        await self.writer.wait_closed()
+
+
+async def open_stream(host, port, binary=BINARY_PROTOCOL, path=None):
+    """Mở kết nối TCP tới (host, port), hoặc Unix socket nếu có `path`."""
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path, limit=MAX_FRAME_BYTES)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_FRAME_BYTES)
+    if binary:
+        writer.write(MAGIC)
+    return MessageStream(reader, writer, binary)
+
+
+async def accept_stream(reader, writer):
+    """Phía server: nhìn byte đầu tiên để biết client nói JSON hay nhị phân."""
+    first = await reader.read(1)
+    if not first:
+        return None
+    if first == MAGIC[:1]:
+        rest = await reader.readexactly(len(MAGIC) - 1)
+        if first + rest != MAGIC:
+            raise ProtocolError("Bad protocol magic")
+        return MessageStream(reader, writer, binary=True)
+    return MessageStream(reader, writer, binary=False, prefix=first)
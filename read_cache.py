@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+
+from config import READ_CACHE_TTL, READ_CACHE_SIZE
+
+
+class ReadCache:
+    """Cache ngắn hạn cho các GET mà node này phải forward (key không có local).
+
+    Mỗi mục nhớ version của record; khi node thấy một lần ghi đi qua (put,
+    delete, replica_*, sync) thì mục bị xoá, trừ khi nó đã mới bằng hoặc hơn
+    version vừa thấy. `token()` chống trường hợp một lần ghi xảy ra trong lúc
+    request upstream đang chạy: kết quả về sau lần ghi đó sẽ không được cache.
+
+    Giới hạn độ cũ: lần ghi đi qua node khác (client gửi thẳng tới primary,
+    hint được gửi bù, sync) không bao giờ tới node này, nên một mục có thể cũ
+    hơn bản đã ack tối đa `ttl` giây. Vì vậy mặc định tắt (READ_CACHE_TTL = 0).
+    """
+
+    def __init__(self, ttl=READ_CACHE_TTL, max_size=READ_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()   # key -> (response, version, hạn theo monotonic)
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        response, _, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(response)
+
+    def token(self):
+        return self._writes
+
+    def put(self, key, response, token):
+        if not self.enabled or token != self._writes:
+            return
+        version = response.get("value", {}).get("version", 0)
+        self._entries[key] = (dict(response), version, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key, version=None):
+        self._writes += 1
+        entry = self._entries.get(key)
+        if entry is not None and (version is None or entry[1] < version):
+            del self._entries[key]
@@ -0,0 +1,60 @@
+class Record:
+    """Một bản ghi trong KVStore.
+
+    Dùng __slots__ thay cho dict {"value", "version", "deleted"} để mỗi key
+    tốn ít bộ nhớ hơn nhiều. Dạng dict chỉ được tạo ra ở biên giao thức
+    (to_dict) và khi ghi xuống đĩa. Record không được sửa sau khi tạo:
+    mỗi lần ghi tạo một Record mới.
+
+    `expires_at` (epoch giây, None = không có TTL) là đồng hồ thật để mọi
+    replica hết hạn cùng một thời điểm. Tombstone mang `deleted_at` để được
+    dọn sau TOMBSTONE_GRACE_PERIOD (None với dữ liệu cũ).
+
+    `codec` khác None nghĩa là `value` là bytes đã nén bằng codec đó
+    (value_codec); record được lưu và gửi giữa các node ở dạng nén.
+    """
+
+    __slots__ = ("value", "version", "deleted", "expires_at", "deleted_at", "codec")
+
+    def __init__(self, value, version, deleted=False, expires_at=None, deleted_at=None, codec=None):
+        self.value = value
+        self.version = version
+        self.deleted = deleted
+        self.expires_at = expires_at
+        self.deleted_at = deleted_at
+        self.codec = codec
+
+    @classmethod
+    def from_dict(cls, data):
+        # Một số file dữ liệu cũ không có trường "deleted"
+        return cls(data.get("value"), data.get("version", 0), data.get("deleted", False),
+                   data.get("expires_at"), data.get("deleted_at"), data.get("codec"))
+
+    def to_dict(self):
+        data = {"value": self.value, "version": self.version, "deleted": self.deleted}
+        if self.expires_at is not None:
+            data["expires_at"] = self.expires_at
+        if self.deleted_at is not None:
+            data["deleted_at"] = self.deleted_at
+        if self.codec is not None:
+            data["codec"] = self.codec
+        return data
+
+    def is_expired(self, now):
+        return self.expires_at is not None and not self.deleted and self.expires_at <= now
+
+    def __repr__(self):
+        return (f"Record(value={self.value!r}, version={self.version}, deleted={self.deleted}, "
+                f"expires_at={self.expires_at}, deleted_at={self.deleted_at}, codec={self.codec})")
+
+
+def is_newer(version, deleted, local):
+    """Bản (version, deleted) có thắng record `local` (None = chưa có) không:
+    version cao hơn thắng, cùng version thì tombstone thắng."""
+    if local is None:
+        return (version, deleted) > (0, False)
+    return (version, deleted) > (local.version, local.deleted)
+
+
+def as_dict(record):
+    return record.to_dict() if isinstance(record, Record) else record
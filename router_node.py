@@ -1,49 +1,111 @@
+import bisect
 import hashlib
-import json
 import asyncio
+from collections import OrderedDict
 
-from config import NODE_PORTS as ALL_NODES
+from config import NODE_PORTS as ALL_NODES, VIRTUAL_NODES, NODE_WEIGHTS, RING_CACHE_SIZE, REPLICATION_FACTOR
+from connection_pool import get_pool
+from metrics import metrics
 
 def hash_key(key):
    
     return int(hashlib.sha256(key.encode()).hexdigest(), 16)
 
-def get_responsible_node(key):
-    h = hash_key(key)
-    return ALL_NODES[h % len(ALL_NODES)]
+class HashRing:
+    """Consistent hashing với virtual node.
 
-def get_responsible_nodes(key, replica_count=2):
-    h = hash_key(key)
-    idx = h % len(ALL_NODES)
-    return [ALL_NODES[(idx + i) % len(ALL_NODES)] for i in range(replica_count)]
+    Mỗi node được đặt `vnodes * weight` token trên vòng; key thuộc về token
+    đầu tiên theo chiều kim đồng hồ, replica là các node khác nhau tiếp theo.
+    Thêm/bớt một node chỉ làm dịch chuyển các key nằm cạnh token của node đó.
+    """
 
-async def forward_request(target_port, data, timeout=5):
-    try:
-        print(f"[{target_port}] → Gửi request: {data}")
+    def __init__(self, nodes, vnodes=VIRTUAL_NODES, weights=None, cache_size=RING_CACHE_SIZE):
+        self.nodes = list(nodes)
+        self.vnodes = vnodes
+        self.weights = weights or {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+        points = []
+        for node in self.nodes:
+            count = max(1, int(round(vnodes * self.weights.get(node, 1))))
+            for i in range(count):
+                points.append((hash_key(f"{node}#{i}"), node))
+        points.sort()
+        self.tokens = [token for token, _ in points]
+        self.owners = [node for _, node in points]
+        self._groups = {}   # count -> nhóm replica (đã sort) của từng token
+
+    def preference_list(self, key, count):
+        cache_key = (key, count)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            return list(cached)
+
+        result = self._walk(bisect.bisect_right(self.tokens, hash_key(key)), min(count, len(self.nodes)))
+
+        self._cache[cache_key] = tuple(result)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
 
-        reader, writer = await asyncio.wait_for(
-            asyncio.open_connection('127.0.0.1', target_port), timeout=timeout
-        )
+    def group_of(self, key, count):
+        """Nhóm replica (đã sort) của key, tra thẳng theo token: không qua cache LRU,
+        dùng cho các vòng lặp trên toàn bộ store (rebuild Merkle khi load)."""
+        groups = self._groups.get(count)
+        if groups is None:
+            groups = self._groups[count] = [
+                tuple(sorted(self._walk(idx, min(count, len(self.nodes))))) for idx in range(len(self.tokens))
+            ]
+        return groups[bisect.bisect_right(self.tokens, hash_key(key)) % len(self.tokens)]
 
-        message = json.dumps(data) + '\n'
-        writer.write(message.encode())
-        await writer.drain()
+    def _walk(self, idx, count):
+        group = []
+        for step in range(len(self.tokens)):
+            node = self.owners[(idx + step) % len(self.tokens)]
+            if node not in group:
+                group.append(node)
+                if len(group) == count:
+                    break
+        return group
 
-        response_data = await asyncio.wait_for(reader.readline(), timeout=timeout)
-        if not response_data:
-            raise ConnectionError("Empty response received")
+    def replica_sets(self, count):
+        """Tất cả các nhóm replica (đã sort) xuất hiện trên vòng, mỗi nhóm là một key range."""
+        count = min(count, len(self.nodes))
+        return {tuple(sorted(self._walk(idx, count))) for idx in range(len(self.tokens))}
 
-        response = json.loads(response_data.decode())
-        print(f"[{target_port}] ← Nhận response: {response}")
 
-        writer.close()
-        await writer.wait_closed()
+ring = HashRing(ALL_NODES, weights=NODE_WEIGHTS)
 
-        return response
+def get_responsible_node(key):
+    return ring.preference_list(key, 1)[0]
+
+def get_responsible_nodes(key, replica_count=REPLICATION_FACTOR):
+    return ring.preference_list(key, replica_count)
+
+def get_replica_group(key, replica_count=REPLICATION_FACTOR):
+    return ring.group_of(key, replica_count)
+
+def get_replica_sets(replica_count=REPLICATION_FACTOR):
+    return ring.replica_sets(replica_count)
+
+async def forward_request(target_port, data, timeout=5):
+    # Không in từng request nữa: số lượng / độ trễ theo peer nằm trong metrics
+    action = data.get("action", "") if isinstance(data, dict) else ""
+    latency = metrics.histogram("kv_forward_seconds", "Độ trễ request gửi tới node khác",
+                                peer=target_port, action=action)
+    try:
+        with latency.time():
+            return await get_pool(target_port).request(data, timeout=timeout)
     except asyncio.TimeoutError:
+        metrics.counter("kv_forward_errors_total", "Request tới node khác bị lỗi",
+                        peer=target_port, reason="timeout").inc()
         msg = f"Timeout khi kết nối node {target_port}"
         print(f"[{target_port}] {msg}")
         return {"status": "ERROR", "message": msg}
     except Exception as e:
+        metrics.counter("kv_forward_errors_total", "Request tới node khác bị lỗi",
+                        peer=target_port, reason=type(e).__name__).inc()
         print(f"[{target_port}] Lỗi forwarding: {e}")
         return {"status": "ERROR", "message": f"Forwarding failed: {str(e)}"}
@@ -0,0 +1,368 @@
+import os
+import glob
+import time
+import queue
+import asyncio
+import threading
+import concurrent.futures
+
+from protocol import json_dumps, json_loads
+from record import Record, as_dict
+from binary_snapshot import read_snapshot, write_snapshot, snapshot_path
+from metrics import metrics
+from config import (
+    WAL_SEGMENT_MAX_BYTES, WAL_COMPACT_MIN_SEGMENTS,
+    DURABILITY_MODE, GROUP_COMMIT_WINDOW_MS, SNAPSHOT_FORMAT,
+)
+
+DURABILITY_MODES = ("always", "batch-ms", "none")
+
+
+class SegmentLog:
+    """Log append-only cho KVStore.
+
+    Mỗi thay đổi được ghi thành một dòng JSON vào segment đang mở
+    (`store_kv_node_1.wal.000001`, ...). Khi segment vượt quá kích thước
+    cho phép thì được đóng lại, và một thread nền gộp các segment đã đóng
+    vào file snapshot: file JSON cũ của node, hoặc `store_kv_node_1.snap`
+    (binary_snapshot) khi `snapshot_format="binary"`. Ở chế độ binary, nếu
+    chưa có .snap thì snapshot JSON được đọc và chuyển sang .snap ở lần
+    compaction / checkpoint kế tiếp.
+    """
+
+    def __init__(self, snapshot_file, segment_max_bytes=WAL_SEGMENT_MAX_BYTES,
+                 compact_min_segments=WAL_COMPACT_MIN_SEGMENTS, snapshot_format=SNAPSHOT_FORMAT):
+        self.snapshot_file = snapshot_file
+        self.binary_file = snapshot_path(snapshot_file) if snapshot_format == "binary" else None
+        self.segment_prefix = os.path.splitext(snapshot_file)[0] + ".wal."
+        self.segment_max_bytes = segment_max_bytes
+        self.compact_min_segments = compact_min_segments
+
+        self._lock = threading.Lock()           # bảo vệ danh sách segment / file đang mở
+        self._snapshot_lock = threading.Lock()  # chỉ một tiến trình ghi snapshot tại một thời điểm
+        self._compactor = None
+
+        self.segments = self._list_segments()
+        self.next_id = (self.segments[-1] + 1) if self.segments else 1
+        self.active_id = None
+        self.active = None
+        self.active_size = 0
+        self._pending = []
+
+    def _segment_path(self, seg_id):
+        return f"{self.segment_prefix}{seg_id:06d}"
+
+    def _list_segments(self):
+        ids = []
+        for path in glob.glob(self.segment_prefix + "*"):
+            suffix = path[len(self.segment_prefix):]
+            if suffix.isdigit():
+                ids.append(int(suffix))
+        return sorted(ids)
+
+    # --- Đọc ---
+
+    def _read_snapshot(self):
+        if self.binary_file is not None and os.path.exists(self.binary_file):
+            return read_snapshot(self.binary_file)
+        if not os.path.exists(self.snapshot_file):
+            return {}
+        with open(self.snapshot_file, "r") as f:
+            content = f.read().strip()
+        if not content:
+            print(f"[Store] Warning: Empty store file at {self.snapshot_file}")
+            return {}
+        return json_loads(content)
+
+    def _replay_segment(self, seg_id, store, record_factory=None):
+        path = self._segment_path(seg_id)
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json_loads(line)
+                except ValueError:
+                    # Dòng cuối bị ghi dở khi node crash -> bỏ qua
+                    print(f"[Store] Warning: Skipping torn record in {path}")
+                    continue
+                record = entry["record"]
+                if record is None:
+                    # Tombstone đã được dọn (purge)
+                    store.pop(entry["key"], None)
+                else:
+                    store[entry["key"]] = record_factory(record) if record_factory else record
+
+    def load(self, record_factory=None):
+        """Đọc snapshot rồi replay toàn bộ segment theo thứ tự.
+
+        `record_factory` chuyển mỗi record dạng dict sang kiểu dùng trong RAM.
+        """
+        try:
+            store = self._read_snapshot()
+            if record_factory is not None:
+                # Snapshot nhị phân đã trả về Record (value nạp lười)
+                store = {key: record if isinstance(record, Record) else record_factory(record)
+                         for key, record in store.items()}
+        except Exception as e:
+            print(f"[Store] Warning: Failed to load store file {self.snapshot_file}: {e}")
+            store = {}
+
+        for seg_id in self.segments:
+            try:
+                self._replay_segment(seg_id, store, record_factory)
+            except Exception as e:
+                print(f"[Store] Warning: Failed to replay segment {self._segment_path(seg_id)}: {e}")
+
+        self._open_new_segment()
+        return store
+
+    # --- Ghi ---
+
+    def _open_new_segment(self):
+        if self.active is not None:
+            self.active.close()
+        self.active_id = self.next_id
+        self.next_id += 1
+        self.segments.append(self.active_id)
+        self.active = open(self._segment_path(self.active_id), "a")
+        self.active_size = 0
+
+    def append(self, key, record):
+        """Đưa record vào buffer; chỉ xuống file khi được PersistenceWorker ghi."""
+        self._pending.append((key, record))
+
+    def take_pending(self):
+        entries, self._pending = self._pending, []
+        return entries
+
+    def write_entries(self, entries, fsync=False):
+        """Ghi một lô record bằng một lần write (và một lần fsync nếu cần)."""
+        if not entries:
+            return
+        data = "".join(json_dumps({"key": key, "record": as_dict(record)}) + "\n" for key, record in entries)
+        with self._lock:
+            self.active.write(data)
+            self.active.flush()
+            if fsync:
+                os.fsync(self.active.fileno())
+            self.active_size += len(data)
+            if self.active_size >= self.segment_max_bytes:
+                self._open_new_segment()
+        self.maybe_compact()
+
+    # --- Compaction ---
+
+    def sealed_segments(self):
+        with self._lock:
+            return [seg_id for seg_id in self.segments if seg_id != self.active_id]
+
+    def maybe_compact(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        if len(self.sealed_segments()) < self.compact_min_segments:
+            return
+        self._compactor = threading.Thread(target=self.compact, daemon=True)
+        self._compactor.start()
+
+    def compact(self):
+        """Gộp các segment đã đóng vào snapshot. Chỉ đọc file, không đụng tới dict trong RAM."""
+        with self._snapshot_lock:
+            sealed = self.sealed_segments()
+            if not sealed:
+                return
+            try:
+                store = self._read_snapshot()
+                for seg_id in sealed:
+                    self._replay_segment(seg_id, store)
+                self._write_snapshot(store)
+            except Exception as e:
+                print(f"[Store] Warning: Compaction failed: {e}")
+                return
+
+            # Snapshot mới đã chứa các segment này; nếu crash trước khi xoá xong
+            # thì replay lại chúng lần nữa vẫn cho ra cùng kết quả.
+            with self._lock:
+                self.segments = [s for s in self.segments if s not in sealed]
+            for seg_id in sealed:
+                try:
+                    os.remove(self._segment_path(seg_id))
+                except FileNotFoundError:
+                    pass
+
+    def _write_snapshot(self, store):
+        if self.binary_file is not None:
+            write_snapshot(self.binary_file, store)
+            return
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write(json_dumps({key: as_dict(record) for key, record in store.items()}, indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+    def checkpoint(self, store):
+        """Ghi toàn bộ store trong RAM thành snapshot và bỏ hết các segment cũ."""
+        with self._snapshot_lock:
+            with self._lock:
+                self._write_snapshot(store)
+                old_segments = list(self.segments)
+                self.segments = []
+                self._open_new_segment()
+            for seg_id in old_segments:
+                try:
+                    os.remove(self._segment_path(seg_id))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        with self._lock:
+            if self.active is not None:
+                self.active.close()
+                self.active = None
+
+    def destroy(self, keep_json=False):
+        """Đóng log và xoá snapshot cùng mọi segment (dữ liệu đã được chuyển sang file khác).
+
+        `keep_json`: giữ lại snapshot JSON (file store gốc của node được git theo dõi).
+        """
+        self.close()
+        paths = [self._segment_path(seg_id) for seg_id in self._list_segments()]
+        if not keep_json:
+            paths.append(self.snapshot_file)
+        if self.binary_file is not None:
+            paths.append(self.binary_file)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class PersistenceWorker(threading.Thread):
+    """Thread duy nhất được ghi vào file của SegmentLog.
+
+    Event loop chỉ đẩy công việc vào queue và nhận lại một
+    `concurrent.futures.Future`; các lô ghi nằm sẵn trong queue được gộp
+    thành một lần write + fsync.
+    """
+
+    def __init__(self, log, window_ms=0):
+        super().__init__(daemon=True, name=f"persistence-{os.path.basename(log.snapshot_file)}")
+        self.log = log
+        self.window_ms = window_ms
+        self.queue = queue.Queue()
+
+    def submit(self, entries, fsync):
+        future = concurrent.futures.Future()
+        self.queue.put(("write", (entries, fsync), future))
+        return future
+
+    def submit_call(self, func, *args):
+        future = concurrent.futures.Future()
+        self.queue.put(("call", (func, args), future))
+        return future
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        running = True
+        while running:
+            job = self.queue.get()
+            if job is None:
+                break
+            if self.window_ms and job[0] == "write":
+                time.sleep(self.window_ms / 1000)
+
+            jobs = [job]
+            while True:
+                try:
+                    job = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    running = False
+                    break
+                jobs.append(job)
+
+            writes = []
+            for kind, payload, future in jobs:
+                if kind == "write":
+                    writes.append((payload, future))
+                    continue
+                self._write_batch(writes)
+                writes = []
+                func, args = payload
+                try:
+                    future.set_result(func(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            self._write_batch(writes)
+
+    def _write_batch(self, writes):
+        if not writes:
+            return
+        entries = [entry for (batch, _), _ in writes for entry in batch]
+        fsync = any(fsync for (_, fsync), _ in writes)
+        try:
+            with metrics.histogram("kv_wal_write_seconds", "Thời gian write (+ fsync) một lô WAL",
+                                   fsync=str(fsync).lower()).time():
+                self.log.write_entries(entries, fsync)
+            # Counter bình thường chỉ dùng trên event loop; ở đây chỉ thread này ghi vào
+            metrics.counter("kv_wal_entries_total", "Số record đã ghi vào WAL").inc(len(entries))
+        except Exception as e:
+            for _, future in writes:
+                future.set_exception(e)
+        else:
+            for _, future in writes:
+                future.set_result(None)
+
+
+class GroupCommitter:
+    """Gom các lần ghi đồng thời thành một lần flush/fsync trên PersistenceWorker.
+
+    - "always":   mỗi commit chờ flush + fsync.
+    - "batch-ms": worker đợi thêm `window_ms` để gom các writer đến sau rồi
+                  mới flush + fsync một lần cho cả lô.
+    - "none":     đẩy sang worker rồi trả về ngay, không fsync.
+    """
+
+    def __init__(self, log, mode=DURABILITY_MODE, window_ms=GROUP_COMMIT_WINDOW_MS):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {mode}")
+        self.log = log
+        self.mode = mode
+        self.worker = PersistenceWorker(log, window_ms if mode == "batch-ms" else 0)
+        self.worker.start()
+        self._last = None
+
+    def _submit(self):
+        entries = self.log.take_pending()
+        if entries:
+            self._last = self.worker.submit(entries, fsync=self.mode != "none")
+        # Nếu buffer đã được một writer khác lấy đi thì chờ chính lô đó
+        return self._last
+
+    def flush_now(self):
+        future = self._submit()
+        if future is not None:
+            future.result()
+
+    async def commit(self):
+        """Trả về khi tất cả record đã append trước đó đã xuống đĩa theo chế độ hiện tại."""
+        future = self._submit()
+        if future is None or self.mode == "none":
+            return
+        await asyncio.wrap_future(future)
+
+    def run(self, func, *args):
+        """Chạy `func` trên worker, sau mọi lần ghi đã gửi trước đó."""
+        self._submit()
+        return self.worker.submit_call(func, *args)
+
+    def close(self):
+        self._submit()
+        self.worker.stop()
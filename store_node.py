@@ -1,82 +1,214 @@
-import os
-import json
+import time
+import asyncio
+from itertools import islice
+
+from storage_engine import SegmentLog, GroupCommitter
+from merkle_tree import MerkleIndex
+from key_index import SortedKeys
+from timer_wheel import TimerWheel
+from record import Record
+from metrics import metrics
+from config import DURABILITY_MODE, GROUP_COMMIT_WINDOW_MS, TOMBSTONE_GRACE_PERIOD
 
 class KVStore:
-    def __init__(self, store_file):
+    def __init__(self, store_file, durability=DURABILITY_MODE, commit_window_ms=GROUP_COMMIT_WINDOW_MS, load=True):
         self.store_file = store_file
-        self.store = self.load_store()
+        self.log = SegmentLog(store_file)
+        self.committer = GroupCommitter(self.log, durability, commit_window_ms)
+        self.merkle = MerkleIndex()
+        self.index = SortedKeys()
+        self.expiry = TimerWheel(time.time())
+        self.gc_wheel = TimerWheel(time.time())
+        self.tombstones = 0             # số tombstone đang giữ
+        self.tombstones_reclaimed = 0   # số tombstone đã dọn kể từ khi node chạy
+        self.store = self.load_store() if load else {}
+
+    def _rebuild_indexes(self, store):
+        self.merkle.rebuild(store)
+        self.index = SortedKeys(store)
+        self.expiry = TimerWheel(time.time())
+        self.gc_wheel = TimerWheel(time.time())
+        self.tombstones = 0
+        for key, record in store.items():
+            if record.deleted:
+                self.tombstones += 1
+                self._schedule_gc(key, record)
+            elif record.expires_at is not None:
+                self.expiry.schedule(record.expires_at, key)
+
+    def _schedule_gc(self, key, record):
+        # Tombstone cũ không có deleted_at coi như đã hết hạn ân hạn
+        self.gc_wheel.schedule((record.deleted_at or 0) + TOMBSTONE_GRACE_PERIOD, key)
 
     def load_store(self):
-        if os.path.exists(self.store_file):
-            try:
-                with open(self.store_file, "r") as f:
-                    content = f.read().strip()
-                    if not content:
-                        print(f"[Store] Warning: Empty store file at {self.store_file}")
-                        return {}
-                    return json.loads(content)
-            except Exception as e:
-                print(f"[Store] Warning: Failed to load store file {self.store_file}: {e}")
-                return {}
-        return {}
+        store = self.committer.run(self.log.load, Record.from_dict).result()
+        self._rebuild_indexes(store)
+        return store
+
+    async def load_store_async(self):
+        """Đọc store trên persistence worker để không chặn event loop."""
+        self.store = await asyncio.wrap_future(self.committer.run(self.log.load, Record.from_dict))
+        self._rebuild_indexes(self.store)
+        return self.store
 
     def save_store(self):
-        with open(self.store_file, "w") as f:
-            json.dump(self.store, f, indent=2)
+        """Checkpoint: ghi toàn bộ store thành snapshot (không cần gọi sau mỗi lần ghi)."""
+        with metrics.histogram("kv_checkpoint_seconds", "Thời gian ghi snapshot").time():
+            self.committer.run(self.log.checkpoint, dict(self.store)).result()
+
+    def set_record(self, key, record):
+        """Điểm ghi duy nhất: cập nhật RAM và append một record vào log.
+
+        Record chỉ chắc chắn nằm trên đĩa sau khi `await commit()` trả về.
+        Nhận cả record dạng dict (từ giao thức) lẫn Record.
+        """
+        if isinstance(record, dict):
+            record = Record.from_dict(record)
+        old = self.store.get(key)
+        self.merkle.update(key, old, record)
+        if old is None:
+            self.index.add(key)
+        elif old.deleted:
+            self.tombstones -= 1
+        if record.deleted:
+            self.tombstones += 1
+            self._schedule_gc(key, record)
+        elif record.expires_at is not None:
+            self.expiry.schedule(record.expires_at, key)
+        self.store[key] = record
+        self.log.append(key, record)
+        return record
+
+    def expire(self, key, record):
+        """Thay record hết hạn bằng tombstone cùng version.
+
+        Không cần replicate: replica nào cũng tự hết hạn theo cùng `expires_at`,
+        và khi so version bằng nhau thì tombstone luôn thắng.
+        """
+        return self.set_record(key, Record(None, record.version, deleted=True, deleted_at=record.expires_at))
+
+    def expire_due(self, now=None):
+        """Chuyển các key mà timer wheel báo tới hạn thành tombstone; trả về số key đã hết hạn."""
+        now = time.time() if now is None else now
+        expired = 0
+        for key in self.expiry.advance(now):
+            record = self.store.get(key)
+            # Key có thể đã bị ghi lại với hạn khác sau khi được hẹn
+            if record is not None and record.is_expired(now):
+                self.expire(key, record)
+                expired += 1
+        return expired
+
+    async def commit(self):
+        await self.committer.commit()
+
+    def flush(self):
+        """Bản đồng bộ của commit(), dùng cho các API put/delete không chạy trong event loop."""
+        self.committer.flush_now()
+
+    def due_tombstones(self, now=None):
+        """Các cặp (key, tombstone) đã qua TOMBSTONE_GRACE_PERIOD, theo timer wheel."""
+        now = time.time() if now is None else now
+        due = []
+        for key in self.gc_wheel.advance(now):
+            record = self.store.get(key)
+            # Key có thể đã được ghi lại (hoặc xoá lại) sau khi được hẹn
+            if record is not None and record.deleted and (record.deleted_at or 0) + TOMBSTONE_GRACE_PERIOD <= now:
+                due.append((key, record))
+        return due
+
+    def retry_tombstone_gc(self, key, when):
+        self.gc_wheel.schedule(when, key)
+
+    def purge(self, key, version):
+        """Xoá hẳn tombstone `version` của key khỏi RAM, index và (qua log) khỏi đĩa."""
+        record = self.store.get(key)
+        if record is None or not record.deleted or record.version != version:
+            return False
+        self.merkle.update(key, record, None)
+        self.index.discard(key)
+        del self.store[key]
+        self.tombstones -= 1
+        self.tombstones_reclaimed += 1
+        self.log.append(key, None)
+        return True
+
+    def write(self, key, value, version, deleted=False, expires_at=None, deleted_at=None, codec=None):
+        """`value` đã ở dạng lưu trữ: nếu `codec` khác None thì là bytes đã nén."""
+        if deleted:
+            return self.set_record(key, Record(None, version, True, deleted_at=deleted_at or time.time()))
+        return self.set_record(key, Record(value, version, expires_at=expires_at, codec=codec))
+
+    def get_record(self, key):
+        """Record của key; key đã quá hạn TTL được hết hạn ngay tại đây (lazy expiry)."""
+        record = self.store.get(key)
+        if record is not None and record.expires_at is not None and record.is_expired(time.time()):
+            record = self.expire(key, record)
+        return record
+
+    def version_of(self, key):
+        record = self.store.get(key)
+        return record.version if record else 0
+
+    def export(self, keys=None):
+        """Dạng dict {key: {"value", "version", "deleted"}} để trả qua giao thức."""
+        if keys is None:
+            return {key: record.to_dict() for key, record in self.store.items()}
+        return {key: self.store[key].to_dict() for key in keys if key in self.store}
+
+    def iter_records(self, start=None, end=None, after=None, prefix="", include_deleted=False):
+        """Duyệt lười các cặp (key, Record) có key trong [start, end), sau `after`
+        và bắt đầu bằng `prefix`, theo thứ tự key (dùng index có thứ tự)."""
+        if prefix and (start is None or start < prefix):
+            start = prefix
+        now = time.time()
+        for key in self.index.irange(start, end, after):
+            if not key.startswith(prefix):
+                break
+            record = self.store[key]
+            # Record quá hạn nhưng expirer chưa kịp xử lý được coi như đã xoá
+            if include_deleted or not (record.deleted or record.is_expired(now)):
+                yield key, record
+
+    def scan(self, after=None, limit=100, prefix="", include_deleted=False):
+        """Tối đa `limit` cặp (key, Record) theo thứ tự key, bắt đầu sau key `after`."""
+        return list(islice(self.iter_records(after=after, prefix=prefix, include_deleted=include_deleted), limit))
 
     def put(self, key, value):
-        if key in self.store:
-            current_version = self.store[key].get("version", 0) + 1
-        else:
-            current_version = 1
-
-        self.store[key] = {
-            "value": value,
-            "version": current_version,
-            "deleted": False
-        }
-        self.save_store()
+        current_version = self.version_of(key) + 1
+        self.write(key, value, current_version)
+        self.flush()
         return current_version
 
     def get(self, key):
-        return self.store.get(key, None)
+        record = self.get_record(key)
+        return record.to_dict() if record else None
 
     def get_with_version(self, key):
         """Trả về cả value và version, dùng khi sync/replica."""
-        return self.store.get(key, None)
+        return self.get(key)
 
     def delete(self, key):
         if key in self.store:
-            current_version = self.store[key].get("version", 0) + 1
-            self.store[key] = {
-                "value": None,
-                "version": current_version,
-                "deleted": True
-            }
-            self.save_store()
+            self.write(key, None, self.version_of(key) + 1, deleted=True)
+            self.flush()
             return True
         return False
 
     def replica_put(self, key, value, version):
-        current_version = self.store.get(key, {}).get("version", 0)
-        if version > current_version:
-            self.store[key] = {
-                "value": value,
-                "version": version,
-                "deleted": False
-            }
-            self.save_store()
+        if version > self.version_of(key):
+            self.write(key, value, version)
+            self.flush()
             return True
         return False
 
     def replica_delete(self, key, version):
-        current_version = self.store.get(key, {}).get("version", 0)
-        if version > current_version:
-            self.store[key] = {
-                "value": None,
-                "version": version,
-                "deleted": True
-            }
-            self.save_store()
+        if version > self.version_of(key):
+            self.write(key, None, version, deleted=True)
+            self.flush()
             return True
-        return False
\ No newline at end of file
+        return False
+
+    def close(self):
+        self.committer.close()
+        self.log.close()
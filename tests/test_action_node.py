@@ -0,0 +1,70 @@
+import asyncio
+
+import action_node
+from action_node import KVNodeLogic
+from node_status_manager import node_status_manager
+from router_node import get_responsible_nodes
+from store_node import KVStore
+from config import NODE_PORTS, STATUS_OK
+
+
+def non_owned_key(port):
+    return next(f"k{i}" for i in range(1000) if port not in get_responsible_nodes(f"k{i}"))
+
+
+def test_get_after_put_does_not_join_older_upstream_read(tmp_path, monkeypatch):
+    port = NODE_PORTS[0]
+    key = non_owned_key(port)
+    upstream = {"value": "v1", "version": 1}
+
+    async def fake_forward(target_port, data, timeout=5):
+        if data["action"] == "get":
+            record = dict(upstream)
+            if record["value"] == "v1":
+                await asyncio.sleep(0.2)     # upstream read chậm, bắt đầu trước lần ghi
+            return {"status": STATUS_OK, "value": record}
+        if data["action"] == "put":
+            upstream.update(value=data["value"], version=upstream["version"] + 1)
+            return {"status": STATUS_OK, "message": f"Updated {key}", "acks": 1}
+        return {"status": STATUS_OK}
+
+    monkeypatch.setattr(action_node, "forward_request", fake_forward)
+    monkeypatch.setattr(node_status_manager, "is_alive", lambda node_id, threshold=None: True)
+
+    async def scenario():
+        kv = KVStore(str(tmp_path / "store.json"), durability="none")
+        logic = KVNodeLogic(kv, port, lambda message: None)
+        try:
+            slow_get = asyncio.create_task(logic.handle({"action": "get", "key": key}))
+            await asyncio.sleep(0.05)
+            put = await logic.handle({"action": "put", "key": key, "value": "v2"})
+            assert put["status"] == STATUS_OK
+            fresh = await logic.handle({"action": "get", "key": key})
+            assert fresh["value"]["value"] == "v2"
+            assert (await slow_get)["value"]["value"] == "v1"
+        finally:
+            logic.handoff.close()
+            kv.close()
+
+    asyncio.run(scenario())
+
+
+def test_replica_batch_tombstone_wins_at_equal_version(tmp_path):
+    async def scenario():
+        kv = KVStore(str(tmp_path / "store.json"), durability="none")
+        logic = KVNodeLogic(kv, NODE_PORTS[0], lambda message: None)
+        try:
+            kv.write("a", "live", 3)
+            kv.write("b", "live", 3)
+            response = await logic.handle({"action": "replica_batch", "records": {
+                "a": {"value": None, "version": 3, "deleted": True},
+                "b": {"value": "old", "version": 2, "deleted": False},
+            }})
+            assert response["results"] == {"a": "Replicated", "b": "Ignored older version"}
+            assert kv.get_record("a").deleted
+            assert kv.get_record("b").value == "live"
+        finally:
+            logic.handoff.close()
+            kv.close()
+
+    asyncio.run(scenario())
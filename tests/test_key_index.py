@@ -0,0 +1,63 @@
+import pytest
+
+import key_index
+from key_index import SortedKeys
+
+KEYS = [f"k{i:03d}" for i in range(0, 100, 2)]   # k000, k002, ..., k098
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    # Khối nhỏ để các khoảng duyệt cắt qua nhiều khối
+    monkeypatch.setattr(key_index, "CHUNK_SIZE", 4)
+    index = SortedKeys(reversed(KEYS))
+    assert len(index._chunks) > 1
+    return index
+
+
+def expected(start=None, end=None, after=None):
+    return [k for k in KEYS
+            if (start is None or k >= start)
+            and (end is None or k < end)
+            and (after is None or k > after)]
+
+
+@pytest.mark.parametrize("start, end, after", [
+    (None, None, None),
+    ("k010", None, None),
+    ("k011", None, None),
+    (None, "k020", None),
+    (None, "k021", None),
+    ("k010", "k020", None),
+    (None, None, "k010"),
+    (None, None, "k011"),
+    ("k010", "k030", "k020"),
+    ("k020", "k030", "k010"),
+    ("k007", "k008", None),
+    ("a", "z", None),
+    ("k098", None, None),
+    ("z", None, None),
+    (None, None, "k098"),
+    (None, "a", None),
+])
+def test_irange_bounds(keys, start, end, after):
+    assert list(keys.irange(start, end, after)) == expected(start, end, after)
+
+
+def test_add_and_discard_keep_order_across_chunk_splits(monkeypatch):
+    monkeypatch.setattr(key_index, "CHUNK_SIZE", 2)
+    index = SortedKeys()
+    for key in reversed(KEYS):
+        index.add(key)
+    index.add("k000")
+    assert len(index) == len(KEYS)
+    assert list(index.irange()) == KEYS
+    assert len(index._chunks) > 1
+
+    for key in KEYS[::3]:
+        index.discard(key)
+    index.discard("missing")
+    remaining = [k for k in KEYS if k not in KEYS[::3]]
+    assert len(index) == len(remaining)
+    assert list(index.irange()) == remaining
+    assert "k002" in index and "k000" not in index
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from config import MAX_FRAME_BYTES
+from protocol import (MessageStream, ProtocolError, decode_payload, encode_frame,
+                      json_dumps, json_loads)
+
+
+@pytest.mark.parametrize("value", [
+    {"a": b"\x00\xff"},
+    {"__bytes__": "aGk="},
+    [{"__bytes__": "x", "y": 2}],
+    {"__bytes__~": 1, "__bytes__": b"x"},
+    {"__bytes__~~": {"__bytes__": "q"}},
+    {"v": "__bytes__", "__bytesX": 1},
+])
+def test_json_roundtrip_keeps_user_dicts_apart_from_bytes(value):
+    text = json_dumps(value)
+    assert json_loads(text) == value
+    assert json_loads(text.encode()) == value
+
+
+def test_json_bytes_envelope_unchanged_for_plain_values():
+    assert json_dumps({"a": b"hi"}) == '{"a": {"__bytes__": "aGk="}}'
+    assert json_loads('{"__bytes__": "aGk="}') == b"hi"
+
+
+@pytest.mark.parametrize("message", [
+    None, True, False, 0, -1, 2**63 - 1, -2**63, 2**63, -2**100, 1.5, "", "xin chào",
+    b"", b"\x00\xff", [], {},
+    {"action": "put", "key": "k", "value": [1, {"b": b"x", "n": None}], "version": 7},
+])
+def test_frame_roundtrip(message):
+    frame = encode_frame(message)
+    assert int.from_bytes(frame[:4], "big") == len(frame) - 4
+    decoded = decode_payload(frame[4:])
+    assert decoded == message and type(decoded) is type(message)
+
+
+def test_decode_rejects_trailing_and_truncated_payloads():
+    payload = encode_frame({"key": "k", "value": b"abc"})[4:]
+    with pytest.raises(ProtocolError):
+        decode_payload(payload + b"N")
+    for cut in range(len(payload)):
+        with pytest.raises(ProtocolError):
+            decode_payload(payload[:cut])
+
+
+def read_from(data):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await MessageStream(reader, None, binary=True).read_message()
+    return asyncio.run(run())
+
+
+def test_stream_reads_frame_and_rejects_oversized_header():
+    assert read_from(encode_frame({"a": 1})) == {"a": 1}
+    assert read_from(b"") is None
+    with pytest.raises(ProtocolError):
+        read_from((MAX_FRAME_BYTES + 1).to_bytes(4, "big"))
@@ -0,0 +1,43 @@
+from router_node import HashRing, hash_key
+
+NODES = [5001, 5002, 5003, 5004]
+KEYS = [f"key{i}" for i in range(2000)]
+
+
+def test_preference_list_starts_at_owner_and_has_distinct_nodes():
+    ring = HashRing(NODES, vnodes=32)
+    for key in KEYS[:200]:
+        nodes = ring.preference_list(key, 3)
+        assert len(nodes) == len(set(nodes)) == 3
+        assert nodes[0] == ring.preference_list(key, 1)[0]
+        assert ring.group_of(key, 3) == tuple(sorted(nodes))
+    # Xin nhiều replica hơn số node thì chỉ trả về mọi node một lần
+    assert sorted(ring.preference_list("x", 10)) == NODES
+
+
+def test_owner_wraps_around_past_last_token():
+    ring = HashRing(NODES, vnodes=8)
+    first = ring.owners[0]
+    wrapped = [k for k in KEYS if hash_key(k) >= ring.tokens[-1]]
+    assert wrapped
+    for key in wrapped:
+        assert ring.preference_list(key, 1) == [first]
+
+
+def test_adding_node_only_moves_keys_to_new_node():
+    before = HashRing(NODES, vnodes=64)
+    after = HashRing(NODES + [5005], vnodes=64)
+    moved = 0
+    for key in KEYS:
+        old, new = before.preference_list(key, 1)[0], after.preference_list(key, 1)[0]
+        if old != new:
+            assert new == 5005
+            moved += 1
+    # Kỳ vọng ~1/5 số key; chừa rộng để không phụ thuộc vào phân bố hash
+    assert 0 < moved < len(KEYS) * 0.35
+
+
+def test_weight_scales_share_of_keys():
+    ring = HashRing([1, 2], vnodes=64, weights={2: 3})
+    owned = sum(ring.preference_list(k, 1)[0] == 2 for k in KEYS)
+    assert owned > len(KEYS) * 0.6
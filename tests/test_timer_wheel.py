@@ -0,0 +1,60 @@
+from timer_wheel import TimerWheel
+
+
+def run_until(wheel, stop, step=1):
+    """Quay từng tick, trả về {item: tick đầu tiên item tới hạn}."""
+    fired = {}
+    for now in range(step, stop + 1, step):
+        for item in wheel.advance(now):
+            fired[item] = now
+    return fired
+
+
+def test_items_fire_on_first_tick_after_deadline():
+    wheel = TimerWheel(0, tick=1, slots=4, levels=2)
+    deadlines = {f"d{d}": d for d in (0, 1, 3, 4, 5, 15, 16, 17)}
+    for item, deadline in deadlines.items():
+        wheel.schedule(deadline, item)
+    assert len(wheel) == len(deadlines)
+
+    fired = run_until(wheel, 20)
+    assert fired == {item: deadline + 1 for item, deadline in deadlines.items()}
+    assert len(wheel) == 0
+
+
+def test_cascade_from_upper_levels():
+    wheel = TimerWheel(0, tick=1, slots=4, levels=3)
+    # 4..15 nằm ở tầng 1, 16..63 ở tầng 2: đều phải đổ xuống tầng 0 đúng hạn
+    for deadline in range(4, 63):
+        wheel.schedule(deadline, deadline)
+    fired = run_until(wheel, 70)
+    assert fired == {d: d + 1 for d in range(4, 63)}
+
+
+def test_overflow_beyond_top_level_still_fires():
+    wheel = TimerWheel(0, tick=1, slots=4, levels=2)   # tầng cao nhất chỉ phủ 16 tick
+    for deadline in (20, 40, 100):
+        wheel.schedule(deadline, deadline)
+    assert len(wheel.overflow) == 3
+
+    fired = run_until(wheel, 110)
+    assert fired == {20: 21, 40: 41, 100: 101}
+    assert not wheel.overflow and len(wheel) == 0
+
+
+def test_large_jump_fires_everything_due():
+    wheel = TimerWheel(1000.0, tick=0.5, slots=8, levels=2)
+    wheel.schedule(1000.2, "soon")
+    wheel.schedule(1100.0, "later")
+    wheel.schedule(5000.0, "far")
+    assert wheel.advance(1000.4) == []
+    assert wheel.advance(1200.0) == ["soon", "later"]
+    assert len(wheel) == 1
+    assert wheel.advance(6000.0) == ["far"]
+
+
+def test_past_deadline_is_due_on_next_advance():
+    wheel = TimerWheel(50, tick=1, slots=4, levels=2)
+    wheel.schedule(10, "old")
+    assert wheel.advance(50) == ["old"]
+    assert len(wheel) == 0
@@ -0,0 +1,78 @@
+from config import TTL_WHEEL_TICK, TTL_WHEEL_SLOTS, TTL_WHEEL_LEVELS
+
+
+class TimerWheel:
+    """Hierarchical timer wheel cho hạn TTL.
+
+    Tầng 0 có TTL_WHEEL_SLOTS ô, mỗi ô là một tick; mỗi tầng phía trên có ô
+    rộng gấp TTL_WHEEL_SLOTS lần tầng dưới. Khi kim tầng dưới quay hết một
+    vòng, ô kế tiếp của tầng trên được đổ xuống (cascade). Hạn xa hơn tầng
+    cao nhất nằm trong `overflow` và được xếp lại mỗi khi tầng đó quay hết vòng.
+
+    `advance()` chỉ đụng tới các ô mà kim đi qua, nên chi phí tỉ lệ với số
+    mục hết hạn chứ không phải số key đang có TTL. Mục không bị huỷ khi key
+    được ghi lại: nơi gọi tự kiểm tra lại hạn của record khi mục tới hạn.
+    """
+
+    def __init__(self, now, tick=TTL_WHEEL_TICK, slots=TTL_WHEEL_SLOTS, levels=TTL_WHEEL_LEVELS):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int(now / tick)
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.overflow = []
+        self._due = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, deadline, item):
+        """Hẹn `item` tới hạn vào thời điểm `deadline` (giây, cùng đồng hồ với `now`)."""
+        self._count += 1
+        # Làm tròn lên tick kế tiếp: item không bao giờ tới hạn sớm hơn deadline
+        self._place(int(deadline / self.tick) + 1, item)
+
+    def _place(self, when, item):
+        delta = when - self.current
+        if delta <= 0:
+            self._due.append(item)
+            return
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots:
+                self.wheels[level][(when // span) % self.slots].append((when, item))
+                return
+            span *= self.slots
+        self.overflow.append((when, item))
+
+    def _cascade(self, level):
+        span = self.slots ** level
+        slot = self.wheels[level][(self.current // span) % self.slots]
+        entries = slot[:]
+        slot.clear()
+        for when, item in entries:
+            self._place(when, item)
+
+    def advance(self, now):
+        """Quay kim tới `now`, trả về các item đã tới hạn."""
+        target = int(now / self.tick)
+        while self.current < target:
+            self.current += 1
+            top_span = self.slots ** self.levels
+            if self.current % top_span == 0 and self.overflow:
+                entries, self.overflow = self.overflow, []
+                for when, item in entries:
+                    self._place(when, item)
+            # Đổ các tầng trên xuống trước (từ cao tới thấp) để mục tới hạn ở tick này rơi vào tầng 0
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % (self.slots ** level) == 0:
+                    self._cascade(level)
+            slot = self.wheels[0][self.current % self.slots]
+            if slot:
+                self._due.extend(item for _, item in slot)
+                slot.clear()
+
+        due, self._due = self._due, []
+        self._count -= len(due)
+        return due
@@ -0,0 +1,42 @@
+import lzma
+import zlib
+
+from config import VALUE_CODEC, VALUE_COMPRESS_THRESHOLD
+
+# codec -> (nén, giải nén) trên bytes
+CODECS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def compress(value, codec=VALUE_CODEC, threshold=VALUE_COMPRESS_THRESHOLD):
+    """(value để lưu, codec) cho một lần ghi mới ở primary.
+
+    Chỉ nén chuỗi có ít nhất `threshold` byte UTF-8, và chỉ giữ bản nén khi nó
+    thực sự nhỏ hơn; ngược lại trả về nguyên value với codec None.
+    """
+    if codec is None or not isinstance(value, str):
+        return value, None
+    data = value.encode()
+    if len(data) < threshold:
+        return value, None
+    packed = CODECS[codec][0](data)
+    if len(packed) >= len(data):
+        return value, None
+    return packed, codec
+
+
+def decompress(value, codec):
+    if codec is None:
+        return value
+    return CODECS[codec][1](value).decode()
+
+
+def for_client(data):
+    """Record dạng dict của giao thức -> bản trả cho client: value đã giải nén, không còn "codec"."""
+    if data.get("codec") is None:
+        return data
+    data = dict(data)
+    data["value"] = decompress(data["value"], data.pop("codec"))
+    return data
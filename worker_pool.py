@@ -0,0 +1,309 @@
+import os
+import zlib
+import heapq
+import asyncio
+from itertools import islice
+
+from connection_pool import ConnectionPool
+from merkle_tree import build_levels, hashes_at, NUM_BUCKETS
+from node_status_manager import node_status_manager
+from storage_engine import SegmentLog
+from hinted_handoff import HintQueue, hint_prefix, hint_files, write_hints
+from metrics import metrics, merge_prometheus
+from record import Record
+from action_node import page_args, encode_cursor
+from config import WORKER_SOCKET_DIR, STATUS_OK, STATUS_ERROR
+
+# Lệnh theo một key: chạy trên worker sở hữu key
+KEY_ACTIONS = {"put", "get", "delete", "replica_put", "replica_delete"}
+# Lệnh nhiều key: tách theo worker, gộp "results"; giá trị là trường chứa key
+BATCH_FIELDS = {"mget": "keys", "mdelete": "keys", "mput": "items", "replica_batch": "records",
+                "merge_records": "records"}
+
+
+def worker_of(key, workers):
+    """Worker sở hữu key trong một node có `workers` process (độc lập với hash ring)."""
+    return zlib.crc32(key.encode()) % workers
+
+
+def socket_path(port, worker_id):
+    return os.path.join(WORKER_SOCKET_DIR, f"node_{port}.w{worker_id}.sock")
+
+
+def worker_store_file(store_file, worker_id, workers):
+    """File store của một worker: data/store_kv_node_1.json -> data/store_kv_node_1.w0of4.json."""
+    if workers <= 1:
+        return store_file
+    base, ext = os.path.splitext(store_file)
+    return f"{base}.w{worker_id}of{workers}{ext}"
+
+
+def _layout_file(store_file):
+    return os.path.splitext(store_file)[0] + ".workers"
+
+
+def current_layout(store_file):
+    try:
+        with open(_layout_file(store_file)) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return 1
+
+
+def repartition(store_file, workers, log=print):
+    """Chia lại dữ liệu của node khi số worker thay đổi (kể cả về 1).
+
+    Đọc toàn bộ file của cách chia cũ, ghi snapshot mới cho từng worker, rồi
+    mới ghi lại số worker và xoá file cũ. Crash giữa chừng thì lần chạy sau
+    làm lại từ cách chia cũ (file mới bị ghi đè). Hàng đợi hint cũng được chia
+    lại theo key, nếu không các lần ghi chờ gửi bù sẽ nằm lại dưới tên file cũ.
+
+    Snapshot JSON của cách chia một worker (data/store_kv_node_N.json, được git
+    theo dõi) không bị xoá; nó chỉ được đọc lại sau khi lần chia về một worker
+    đã ghi đè nó (hoặc đã ghi .snap).
+    """
+    old = current_layout(store_file)
+    if old == workers:
+        return False
+
+    merged = {}
+    old_logs = []
+    for worker_id in range(old):
+        segment_log = SegmentLog(worker_store_file(store_file, worker_id, old))
+        for key, record in segment_log.load(Record.from_dict).items():
+            current = merged.get(key)
+            if current is None or (record.version, record.deleted) > (current.version, current.deleted):
+                merged[key] = record
+        old_logs.append(segment_log)
+
+    hints, old_hint_files = {}, []    # port đích -> {key: record}
+    for worker_id in range(old):
+        for target_port, path in hint_files(hint_prefix(worker_store_file(store_file, worker_id, old))).items():
+            queue = HintQueue(path)
+            queue.close()
+            target = hints.setdefault(target_port, {})
+            for key, record in queue.hints.items():
+                if key not in target or record.get("version", 0) >= target[key].get("version", 0):
+                    target[key] = record
+            old_hint_files.append(path)
+
+    parts = [{} for _ in range(workers)]
+    for key, record in merged.items():
+        parts[worker_of(key, workers)][key] = record
+    for worker_id, part in enumerate(parts):
+        new_file = worker_store_file(store_file, worker_id, workers)
+        segment_log = SegmentLog(new_file)
+        segment_log.checkpoint(part)
+        segment_log.close()
+        for target_port, queue in hints.items():
+            write_hints(f"{hint_prefix(new_file)}{target_port}",
+                        {k: r for k, r in queue.items() if worker_of(k, workers) == worker_id})
+
+    tmp_file = _layout_file(store_file) + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write(str(workers))
+    os.replace(tmp_file, _layout_file(store_file))
+    for segment_log in old_logs:
+        segment_log.destroy(keep_json=old == 1)
+    for path in old_hint_files:
+        os.remove(path)
+    log(f"Repartitioned {len(merged)} keys and {sum(map(len, hints.values()))} hint(s) "
+        f"from {old} to {workers} worker(s)")
+    return True
+
+
+class WorkerRouter:
+    """Chia keyspace local của một node cho `workers` process cùng nghe trên một port.
+
+    Mỗi worker giữ một KVStore riêng cho các key có worker_of(key) == worker_id.
+    Lệnh tới nhầm worker (kernel chia kết nối theo SO_REUSEPORT, không theo key)
+    được chuyển qua Unix socket tới worker sở hữu, gắn "worker_local" để không
+    bị chuyển tiếp lần nữa. Lệnh trên toàn bộ dữ liệu local (scan, range nội bộ,
+    Merkle, get_all_data, get_status, metrics...) được hỏi song song mọi worker
+    rồi gộp lại, nên node khác vẫn thấy node này như một khối.
+    """
+
+    def __init__(self, logic, port, worker_id, workers, timeout=5):
+        self.logic = logic
+        self.port = port
+        self.worker_id = worker_id
+        self.workers = workers
+        self.timeout = timeout
+        self.pools = {
+            i: ConnectionPool(None, None, path=socket_path(port, i))
+            for i in range(workers) if i != worker_id
+        }
+        self._background = set()
+        self.server = None
+
+    async def start_server(self, handle_client):
+        path = socket_path(self.port, self.worker_id)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.server = await asyncio.start_unix_server(handle_client, path)
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for pool in self.pools.values():
+            pool.close()
+
+    def owner(self, key):
+        return worker_of(key, self.workers)
+
+    async def call(self, worker_id, cmd):
+        """Chạy lệnh trên một worker (chính nó thì xử lý tại chỗ, không qua socket)."""
+        message = dict(cmd)
+        message["worker_local"] = True
+        if worker_id == self.worker_id:
+            return await self.handle(message)
+        metrics.counter("kv_worker_handoffs_total", "Lệnh chuyển sang worker khác", target=worker_id).inc()
+        try:
+            return await self.pools[worker_id].request(message, timeout=self.timeout)
+        except Exception as e:
+            return {"status": STATUS_ERROR, "message": f"Worker {worker_id} unavailable: {e or type(e).__name__}"}
+
+    async def gather(self, cmd):
+        return await asyncio.gather(*[self.call(i, cmd) for i in range(self.workers)])
+
+    async def handle(self, cmd):
+        if not isinstance(cmd, dict):
+            return await self.logic.handle(cmd)
+        local = cmd.pop("worker_local", False)
+        action = str(cmd.get("action", "")).lower()
+
+        if action == "heartbeat_seen":
+            node_status_manager.update(cmd.get("from"))
+            return {"status": STATUS_OK}
+        if action == "metrics_text":
+            return {"status": STATUS_OK, "text": metrics.render_prometheus()}
+        if local:
+            return await self.logic.handle(cmd)
+
+        key = cmd.get("key")
+        if action in KEY_ACTIONS and isinstance(key, str):
+            return await self.call(self.owner(key), cmd)
+        if action in BATCH_FIELDS:
+            return await self._split(cmd, BATCH_FIELDS[action])
+        if action in ("get_all_data", "merkle_bucket"):
+            return self._merge_data(await self.gather(cmd))
+        if action == "list_keys":
+            responses = await self.gather(cmd)
+            return self._first_error(responses) or {
+                "status": STATUS_OK, "keys": [k for r in responses for k in r.get("keys", [])]
+            }
+        if action == "merkle_nodes":
+            return await self._merkle_nodes(cmd)
+        if action == "get_status":
+            return self._merge_status(await self.gather(cmd))
+        if action == "metrics":
+            return self._merge_metrics(await self.gather(cmd))
+        if action == "scan" or (action == "range" and cmd.get("internal")):
+            return await self._merge_pages(cmd)
+        return await self.logic.handle(cmd)
+
+    @staticmethod
+    def _first_error(responses):
+        return next((r for r in responses if r.get("status") != STATUS_OK), None)
+
+    async def _split(self, cmd, field):
+        items = cmd.get(field) or ({} if field in ("items", "records") else [])
+        groups = {}
+        for key in items:
+            groups.setdefault(self.owner(key), []).append(key)
+
+        def part(keys):
+            sub = dict(cmd)
+            sub[field] = {k: items[k] for k in keys} if isinstance(items, dict) else keys
+            return sub
+
+        owners = list(groups)
+        responses = await asyncio.gather(*[self.call(w, part(groups[w])) for w in owners])
+        results = {}
+        for w, response in zip(owners, responses):
+            if response.get("status") == STATUS_OK:
+                results.update(response.get("results", {}))
+            else:
+                results.update({k: response for k in groups[w]})
+        return {"status": STATUS_OK, "results": results}
+
+    def _merge_data(self, responses):
+        error = self._first_error(responses)
+        if error is not None:
+            return error
+        data = {}
+        for response in responses:
+            data.update(response.get("data", {}))
+        return {"status": STATUS_OK, "data": data}
+
+    def _merge_status(self, responses):
+        # Trạng thái các node giống nhau ở mọi worker (cùng nhịp heartbeat);
+        # bộ đếm tombstone / read cache thì cộng lại cho cả node
+        error = self._first_error(responses)
+        if error is not None:
+            return error
+        response = dict(responses[self.worker_id])
+        for field in ("tombstones", "read_cache"):
+            response[field] = {name: sum(r[field][name] for r in responses) for name in response[field]}
+        response["workers"] = self.workers
+        return response
+
+    def _merge_metrics(self, responses):
+        # Series của từng worker được gắn label "worker" như output Prometheus
+        error = self._first_error(responses)
+        if error is not None:
+            return error
+        merged = {}
+        for worker_id, response in enumerate(responses):
+            for name, series in response["metrics"].items():
+                merged.setdefault(name, []).extend(
+                    {"labels": dict(item["labels"], worker=str(worker_id)), "value": item["value"]}
+                    for item in series)
+        return {"status": STATUS_OK, "metrics": merged}
+
+    async def _merkle_nodes(self, cmd):
+        # Digest lá là XOR theo key nên gộp được giữa các worker; các tầng trên thì tính lại
+        responses = await self.gather({"action": "merkle_leaves", "group": cmd.get("group", [])})
+        error = self._first_error(responses)
+        if error is not None:
+            return error
+        leaves = [0] * NUM_BUCKETS
+        for response in responses:
+            leaves = [a ^ b for a, b in zip(leaves, response["leaves"])]
+        levels = build_levels(leaves)
+        return {"status": STATUS_OK, "hashes": hashes_at(levels, cmd.get("depth", 0), cmd.get("indices", []))}
+
+    async def _merge_pages(self, cmd):
+        # Mỗi worker trả tối đa `limit` key sau cursor; key của các worker không trùng nhau
+        try:
+            _, limit = page_args(cmd)
+        except (ValueError, TypeError):
+            return {"status": STATUS_ERROR, "message": "Invalid cursor or limit"}
+        responses = await self.gather(cmd)
+        error = self._first_error(responses)
+        if error is not None:
+            return error
+        pages = [list(response.get("data", {}).items()) for response in responses]
+        data = dict(islice(heapq.merge(*pages, key=lambda item: item[0]), limit))
+        if cmd.get("action") == "range":
+            return {"status": STATUS_OK, "data": data}
+        cursor = encode_cursor(next(reversed(data))) if len(data) == limit else None
+        return {"status": STATUS_OK, "data": data, "cursor": cursor}
+
+    def broadcast_heartbeat(self, sender):
+        """Worker giữ kết nối heartbeat báo cho các worker khác để mọi failure
+        detector trong node cùng thấy một nhịp."""
+        for pool in self.pools.values():
+            task = asyncio.create_task(pool.request(
+                {"action": "heartbeat_seen", "from": sender, "worker_local": True}, timeout=self.timeout))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def render_metrics(self):
+        """Output Prometheus của cả node: gộp registry của mọi worker."""
+        responses = await self.gather({"action": "metrics_text"})
+        return merge_prometheus([r["text"] for r in responses if r.get("status") == STATUS_OK])